@@ -30,6 +30,7 @@ setup(
     package_dir={'gspread_rpa': os.path.join('src', 'gspread_rpa')},
     package_data={'': pkg_data},
     install_requires=['gspread'],
+    extras_require={'numpy': ['numpy']},
     license='GPLv3',
     classifiers=[
         'Environment :: Console',
@@ -3,11 +3,24 @@ from gspread.utils import rowcol_to_a1, a1_to_rowcol, ValueRenderOption, ValueIn
 from gspread.auth import local_server_flow
 from gspread.auth import DEFAULT_SCOPES, DEFAULT_CREDENTIALS_FILENAME, DEFAULT_AUTHORIZED_USER_FILENAME
 from .gspreadsheet_retry import SpreadsheetRetry, WorksheetRetry, ClientRetry
-from .gspreadsheet_retry import exceptions, retry, error_quota_req
+from .gspreadsheet_retry import exceptions, retry, error_quota_req, error_transient
+from .retry import current_budget, shared_budget
 from .format_cell import CellFormat, ColorMap
+from .data_cache import DataCache, CacheStore, ExactMatch, merge_dirty
+from .snapshot import SnapshotStore, SnapshotError
+from .quota import configure_quota
+from .circuit import CircuitOpenError, configure_circuit
+from .metrics import metrics_snapshot, add_metrics_hook, remove_metrics_hook
+from .write_batch import WriteBatch, a1_range, range_rect, row_blocks, range_groups
 import logging
 from re import compile, IGNORECASE
 from os import getenv, unlink, path
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from itertools import islice
+from urllib.parse import quote
 
 """
 GoogleSheets HighLevel wrapper around gspread
@@ -17,6 +30,8 @@ __version__ = "1.0.2"
 
 logger = logging.getLogger('GoogleSheets')
 
+REGEX_SPECIAL = frozenset('.^$*+?{}[]\\|()')
+
 
 class CellIndex(object):
     def __init__(self, col=None, row=None):
@@ -60,29 +75,82 @@ class GridIndex(object):
     def __eq__(self, other):
         return  self.start == other.start and self.end == other.end
 
-class DataCache(object):
-
-    def __init__(self):
-        self.cached_cells = []
-        self._expired = True
-
-    def expired(self):
-        return self._expired == True
+class MatchSpans(object):
+    """
+    GoogleSheets.match_spans of cells added one by one in row-major order, the
+    GridIndex are returned as soon as they can't grow anymore (not sorted by length).
+    in search_direction 'row' the runs are grouped column by column, the last run of
+    a column may join the first one of the next column, these are held until close()
+    """
+    def __init__(self, search_direction='col'):
+        self.row_major = search_direction.lower() in ('col', 'x')
+        # row-major: [start, end] of the current run
+        self.current = None
+        # column-major: col -> [first run, last run]
+        self.columns = {}
 
+    def __repr__(self):
+        return "<{} row_major:{} current:{} columns:{}>".format(
+            self.__class__.__name__,
+            self.row_major,
+            self.current,
+            len(self.columns))
+
+    @staticmethod
+    def grid_index(run):
+        (start_col, start_row), (end_col, end_row) = run
+        return GridIndex(start_col, start_row, end_col, end_row)
+
+    """
+    add the cell (col, row), return the list of GridIndex completed
+    """
+    def add(self, col, row):
+        if self.row_major:
+            run = self.current
+            if run and run[1] in ((col - 1, row), (col, row - 1)):
+                run[1] = (col, row)
+                return []
+            self.current = [(col, row), (col, row)]
+            return [self.grid_index(run)] if run else []
+        runs = self.columns.setdefault(col, [None, None])
+        first, last = runs
+        if last and last[1] == (col, row - 1):
+            last[1] = (col, row)
+            return []
+        runs[1] = [(col, row), (col, row)]
+        if last is None:
+            return []
+        if first is None:
+            runs[0] = last
+            return []
+        # neither the first nor the last run of the column
+        return [self.grid_index(last)]
+
+    """
+    return the remaining GridIndex
+    """
     def close(self):
-        self.cached_cells = []
-        self._expired = True
-
-    def store(self, data, cell_start=CellIndex(col=1, row=1)):
-        self.cache_cells = [
-            [
-                gspread.Cell(
-                    row=nrow + cell_start.row,
-                    col=ncol + cell_start.col,
-                    value=val
-                ) for ncol,val in enumerate(row)
-            ] for nrow,row in enumerate(data)]
-        self._expired = False
+        result = []
+        if self.row_major:
+            if self.current:
+                result.append(self.grid_index(self.current))
+            self.current = None
+            return result
+        current = None
+        for col in sorted(self.columns):
+            for run in self.columns[col]:
+                if run is None:
+                    continue
+                if current and current[1] == (run[0][0] - 1, run[0][1]):
+                    current[1] = run[1]
+                    continue
+                if current:
+                    result.append(self.grid_index(current))
+                current = list(run)
+        if current:
+            result.append(self.grid_index(current))
+        self.columns = {}
+        return result
 
 class GoogleSheets(object):
 
@@ -95,16 +163,36 @@ class GoogleSheets(object):
     class InitError (Exception):
         pass
 
+    # lookup_match default_regex whose matches always hold the words of the term
+    INDEXED_REGEX = (r"\b({})\b", r"^({})$", r"^{}$")
+    # lookup_match default_regex equal to a case insensitive whole value comparison
+    EXACT_REGEX = (r"^({})$", r"^{}$")
+    # update_cells request budget, a larger matrix is split by row blocks
+    UPDATE_MAX_BYTES = 2 * 1024 * 1024
+    UPDATE_MAX_CELLS = 100000
+    # update_cells requests sent concurrently
+    UPDATE_WORKERS = 4
+    # get_values_many length of the ranges of one values.batchGet url
+    BATCH_GET_MAX_URL = 8000
+
     """
     run_mode: service for service account, user for oauth (require user interaction)
     if not set at object creation like gs = GoogleSheets(run_mode='service')
     will take the valie from GOOGLESHEETS_RUN_MODE env variable and default to 'service'
+    cache_max_bytes: memory budget of the per worksheet values caches
+    cache_check_interval: seconds a cache is used before checking again the spreadsheet
+                          Drive version, None to never check
+    snapshot_path: SQLite file keeping the fetched worksheets values across process runs,
+                   default to GOOGLESHEETS_SNAPSHOT_PATH env variable, not used if not set
     """
     def __init__(self, run_mode='',
                  scopes=DEFAULT_SCOPES,
                  flow=local_server_flow,
                  credentials_filename=DEFAULT_CREDENTIALS_FILENAME,
-                 authorized_user_filename=DEFAULT_AUTHORIZED_USER_FILENAME):
+                 authorized_user_filename=DEFAULT_AUTHORIZED_USER_FILENAME,
+                 cache_max_bytes=256 * 1024 * 1024,
+                 cache_check_interval=10,
+                 snapshot_path=None):
         assert run_mode in (None, '', 'service', 'user'), "run_mode set and not in 'service' or 'user'"
         self.run_mode = run_mode if run_mode else getenv('GOOGLESHEETS_RUN_MODE', 'service')
         self.spreadsheet_cursor = None
@@ -140,7 +228,21 @@ class GoogleSheets(object):
                 raise self.InitError from None
         self.client_ext = ClientRetry(self.gc.auth, self.gc.session)
         self.placeholder = []
-        self.data_cache = DataCache()
+        self.cache_store = CacheStore(max_bytes=cache_max_bytes)
+        self.cache_check_interval = cache_check_interval
+        snapshot_path = snapshot_path if snapshot_path else getenv('GOOGLESHEETS_SNAPSHOT_PATH')
+        self.snapshot_store = SnapshotStore(snapshot_path) if snapshot_path else None
+        self.write_batch = None
+
+    """
+    values cache of the active worksheet
+    """
+    @property
+    def data_cache(self):
+        worksheet_id = getattr(self.worksheet_cursor, 'id', None)
+        if self.spreadsheet_cursor is None or worksheet_id is None:
+            return DataCache()
+        return self.cache_store.get((self.spreadsheet_cursor.id, worksheet_id))
 
     """
     id
@@ -171,6 +273,8 @@ class GoogleSheets(object):
     def delete_spreadsheet(self):
         logger.info ("delete: {}".format(self.spreadsheet_cursor))
         if self.spreadsheet_cursor is not None:
+            if self.write_batch is not None:
+                self.write_batch.discard(self.spreadsheet_cursor.id)
             try:
                 self.gc.del_spreadsheet(self.spreadsheet_cursor.id)
             except Exception as e:
@@ -234,18 +338,19 @@ class GoogleSheets(object):
     may be used to open an other spreadsheet reusing an existing GoogleSheet instance
     """
     def close(self):
+        self.flush()
         self.spreadsheet_cursor = None
         self.worksheet_cursor = None
         self.cell_current_position = (1, 1)
         self.spreadsheet_revision = None
-        self.data_cache.close()
+        self.cache_store.close()
 
     """
     Open a spreadsheet try in order 'url', id and then title
     if nay tab_name, tab_position, tab_id is set open the worsheet trying first
     'tab_id', 'tab_name', 'tab_position' and then tab '0'
     """
-    @retry(tries=15, delay=5, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=5, backoff=2, except_retry=[error_quota_req, *error_transient])
     def open (self, title=None, url=None, key=None, tab_name=None, tab_position=None, tab_id=None):
         if self.spreadsheet_cursor is None:
             assert any ([title, url, key]), "opening a spreadsheet require a title, an url or a key"
@@ -283,7 +388,7 @@ class GoogleSheets(object):
             else:
                 pass
                 # logger.info ("spreadsheet_revision: {}".format(self.spreadsheet_revision))
-            self.data_cache.close()
+            self.cache_store.discard_spreadsheet(self.spreadsheet_cursor.id)
             if not any ([tab_name, tab_position, tab_id]): return
 
         self.worksheet_cursor = None
@@ -330,7 +435,6 @@ class GoogleSheets(object):
                 (i,w) for (i,w) in
                 enumerate(self.worksheets()) if i == int(0)]
             assert self.worksheet_cursor, "error in open tab position: {}".format(0)
-        self.data_cache.close()
 
     """
     return a list with all the fields for each revision available
@@ -379,6 +483,7 @@ class GoogleSheets(object):
             if fd.name:
                 mime_type = self.ext2mime(fd.name.rpartition('.')[-1])
         assert mime_type, "unknow mime_type"
+        self.flush()
         result = self.client_ext.file_export(
             fd, spreadsheet_id=self.spreadsheet_cursor.id, revision_id=revision_id, mime_type=mime_type)
         return result
@@ -409,6 +514,8 @@ class GoogleSheets(object):
     def overwrite(self, src, delete=True):
         assert isinstance(src, GoogleSheets), "source not a GoogleSheets instance, {}".format(src.__class__)
         assert src.spreadsheet_cursor, "src not open {}".format(src.spreadsheet_cursor)
+        self.flush()
+        src.flush()
         try:
             tmp =  GoogleSheets(run_mode=self.run_mode)
             tmp.create (title="{}.bak".format(self.spreadsheet_cursor.title))
@@ -497,13 +604,12 @@ class GoogleSheets(object):
                     self.worksheet_cursor = self.worksheet_cursor[0]
             else: raise e
         else:
-            self.data_cache.close()
             logger.info("create {}".format(self.worksheet_cursor))
 
     """
     return a list of titles (only='title'), id (only='id') or of the whole object
     """
-    @retry(tries=15, delay=5, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=5, backoff=2, except_retry=[error_quota_req, *error_transient])
     def worksheets(self, only=None):
         if only is None:
             return [WorksheetRetry(w) for w in self.spreadsheet_cursor.worksheets()]
@@ -522,8 +628,9 @@ class GoogleSheets(object):
     def delete_worksheet(self):
         assert self.worksheet_cursor is not None, "no active worksheet to delete"
         logger.info ("delete {}".format(self.worksheet_cursor))
+        self.flush()
+        self.cache_store.discard((self.spreadsheet_cursor.id, self.worksheet_cursor.id))
         self.worksheet_cursor = self.spreadsheet_cursor.del_worksheet(self.worksheet_cursor)
-        self.data_cache.close()
         self.worksheet_cursor = None
 
     """
@@ -531,8 +638,11 @@ class GoogleSheets(object):
     """
     def resize(self, cols=None, rows=None):
         assert self.worksheet_cursor is not None, "no active worksheet to resize"
+        self.flush()
+        self.check_version(self.spreadsheet_cursor.id)
         self.worksheet_cursor.resize(cols=cols, rows=rows)
-        self.data_cache.close()
+        self.data_cache.resize(cols=cols, rows=rows)
+        self.written(self.spreadsheet_cursor.id)
         logger.info ("{} col_count={} row_count={}".format(
             self.worksheet_cursor, self.worksheet_cursor.col_count, self.worksheet_cursor.row_count))
 
@@ -540,7 +650,187 @@ class GoogleSheets(object):
     clear all cached data
     """
     def close_cache (self):
-        self.data_cache.close()
+        self.cache_store.close()
+
+    """
+    buffered write session, update_cell, update_cells and clear are queued and
+    sent on exit (and once more than max_cells are pending) as one values.batchClear
+    and one values.batchUpdate per worksheet and value input option, the adjacent
+    cells are merged into rectangles and the last write of a cell wins.
+    the reads see the pending writes: they are written through the values cache and
+    sent before any read from the network or structural change (delete_rows, resize...)
+        with gs.batch():
+            for i, v in enumerate(values):
+                gs.update_cell(col=1, row=i + 1, value=v)
+    a nested batch() join the current session. if the with body raise, the pending
+    writes are not sent and the caches they were written through are dropped
+    """
+    @contextmanager
+    def batch(self, max_cells=10000):
+        if self.write_batch is not None:
+            yield self.write_batch
+            return
+        self.write_batch = WriteBatch(max_cells=max_cells)
+        try:
+            yield self.write_batch
+        except BaseException:
+            # the pending writes are dropped with the caches they were written through
+            for key in self.write_batch.keys():
+                self.cache_store.discard(key)
+            self.write_batch = None
+            raise
+        try:
+            self.flush()
+        finally:
+            self.write_batch = None
+
+    """
+    send the pending writes of the batch session, return the number of cells updated.
+    if the writes fail the values caches they were written through are dropped
+    """
+    def flush(self):
+        if self.write_batch is None or not self.write_batch.pending:
+            return 0
+        keys = self.write_batch.keys()
+        spreadsheet_ids = set(k[0] for k in keys)
+        for spreadsheet_id in spreadsheet_ids:
+            self.check_version(spreadsheet_id)
+        try:
+            result = self.write_batch.flush()
+        except Exception:
+            for key in keys:
+                self.cache_store.discard(key)
+            raise
+        for spreadsheet_id in spreadsheet_ids:
+            self.stamp_version(spreadsheet_id)
+        return result
+
+    """
+    Drive version of the spreadsheet, incremented on every change
+    """
+    def spreadsheet_version(self, spreadsheet_id=None):
+        spreadsheet_id = spreadsheet_id if spreadsheet_id else self.spreadsheet_cursor.id
+        return self.client_ext.file_metadata(spreadsheet_id, fields='version')['version']
+
+    """
+    before a write to the spreadsheet: expire its caches if it was modified by someone
+    else since they were stamped. like validate_cache the Drive version is read at most
+    every cache_check_interval seconds, the caches written by us since the last check
+    (version None) are stamped with it
+    """
+    def check_version(self, spreadsheet_id):
+        if self.cache_check_interval is None:
+            return
+        caches = self.cache_store.valid(spreadsheet_id)
+        now = time.monotonic()
+        if all(now - cache.checked_at < self.cache_check_interval for cache in caches):
+            return
+        try:
+            version = self.spreadsheet_version(spreadsheet_id)
+        except Exception as e:
+            logger.warning ("check_version {}: {}, caches expired".format(spreadsheet_id, e))
+            version = None
+        for cache in caches:
+            if version is None or (cache.version is not None and cache.version != version):
+                logger.info ("cache version {} != {} before write, expired".format(cache.version, version))
+                cache.close()
+            else:
+                cache.version = version
+                cache.checked_at = now
+
+    """
+    after a write to the spreadsheet: its caches are stamped with the version including
+    the write at the next check (check_version, validate_cache), no request is sent
+    """
+    def written(self, spreadsheet_id):
+        self.cache_store.unstamp(spreadsheet_id)
+
+    """
+    after a batch flush: stamp the caches of the spreadsheet with the version including
+    the writes, one Drive version request. if the version can't be read they are stamped
+    at the next check
+    """
+    def stamp_version(self, spreadsheet_id):
+        self.cache_store.unstamp(spreadsheet_id)
+        if self.cache_check_interval is None or not self.cache_store.valid(spreadsheet_id):
+            return
+        try:
+            version = self.spreadsheet_version(spreadsheet_id)
+        except Exception as e:
+            logger.warning ("stamp_version {}: {}".format(spreadsheet_id, e))
+            return
+        self.cache_store.stamp(spreadsheet_id, version)
+
+    """
+    expire the cache if the spreadsheet was modified by someone else since it was fetched,
+    the check is done at most every cache_check_interval seconds.
+    our own writes are checked before (check_version) and stamped at the next check
+    """
+    def validate_cache(self, cache):
+        if self.cache_check_interval is None or cache.expired():
+            return
+        if time.monotonic() - cache.checked_at < self.cache_check_interval:
+            return
+        version = self.spreadsheet_version()
+        if cache.version is not None and cache.version != version:
+            logger.info ("cache {} version {} != {}, expired".format(self.worksheet_cursor, cache.version, version))
+            cache.close()
+            return
+        cache.version = version
+        cache.checked_at = time.monotonic()
+
+    """
+    return the values cache of the active worksheet, fetch the whole worksheet
+    if expired, fetch again the stale ranges if any
+    """
+    def cached_data(self, max_stale=10):
+        cache = self.data_cache
+        if len(cache.stale) > max_stale:
+            cache.close()
+        if not cache.expired():
+            self.validate_cache(cache)
+        if cache.expired():
+            self.flush()
+            version = None
+            if self.cache_check_interval is not None or self.snapshot_store:
+                version = self.spreadsheet_version()
+            snapshot = self.snapshot_store.load(
+                self.spreadsheet_cursor.id, self.worksheet_cursor.id, version) if self.snapshot_store else None
+            if snapshot:
+                rows, cols, data = snapshot
+                logger.info ("cache {} from snapshot version {}".format(self.worksheet_cursor, version))
+                try:
+                    cache.store (data, version=version, cols=cols)
+                except SnapshotError as e:
+                    logger.warning ("cache {} {}, fetched".format(self.worksheet_cursor, e))
+                    cache.close()
+                    snapshot = None
+            if not snapshot:
+                data = self.get_values()
+                cache.store (data, version=version)
+                if self.snapshot_store:
+                    self.snapshot_store.save(self.spreadsheet_cursor.id, self.worksheet_cursor.id, version, data)
+            self.cache_store.trim()
+        if cache.stale:
+            self.get_values_many(list(cache.stale))
+        cache.shrink()
+        return cache
+
+    """
+    return the values cache of the active worksheet if it is valid and covers the range
+    (end_col, end_row None for the last column, row), None otherwise or if kwargs ask
+    for something else than the formatted values
+    """
+    def fresh_cache(self, start_col, start_row, end_col=None, end_row=None, **kwargs):
+        if kwargs and kwargs != {'value_render_option': ValueRenderOption.formatted}:
+            return None
+        cache = self.data_cache
+        self.validate_cache(cache)
+        end_col = cache.start_col + cache.cols - 1 if end_col is None else end_col
+        end_row = cache.start_row + cache.rows - 1 if end_row is None else end_row
+        if cache.covers(start_col, start_row, end_col, end_row):
+            return cache
+        return None
 
     """
     lookup match in search_direction  X (col) or Y (row)
@@ -548,24 +838,164 @@ class GoogleSheets(object):
     the result list is sorted with the longest at the end
 
     as the funtion use regexpr it may be needed to validate by fetching the data
+
+    the regex is tried once per distinct value through the cache ValueIndex, with the
+    default_regex of INDEXED_REGEX and terms without regex special characters only
+    the values holding the words of the terms are tried. if the regex match an empty
+    cell, every cell is scanned
+
+    mode 'exact' or 'casefold' compare whole values with the terms (as is or case
+    insensitive, special characters are not interpreted) instead of the default_regex,
+    one hash lookup per term, an empty term match the empty cells.
+    default_regex of EXACT_REGEX with plain terms take the same path
+        gs.lookup_match (match=['#REF!'], mode='exact')
+    """
+    def lookup_match (self, match=[], search_direction='col', default_regex=r"\b({})\b", mode=None):
+        return self.lookup_match_many([match], search_direction=search_direction,
+                                      default_regex=default_regex, mode=mode)[tuple(match)]
+
     """
-    def lookup_match (self, match=[], search_direction='col', default_regex=r"\b({})\b"):
+    lookup_match of every match list of matches against the same cached grid
+    return a dict {tuple(match): list of GridIndex}, the queries matching an empty cell
+    are all resolved by a single scan of the grid, the others through the ValueIndex
+        result = gs.lookup_match_many([['Diana', 'Yana'], ['Rava', 'Iosias']], search_direction='x')
+        result[('Diana', 'Yana')]
+    """
+    def lookup_match_many (self, matches=[], search_direction='col', default_regex=r"\b({})\b", mode=None):
         assert self.worksheet_cursor, "worksheet not open"
 
-        if self.data_cache.expired():
-            data = self.get_values()
-            self.data_cache.store (data)
+        cache = self.cached_data()
+
+        queries = {}
+        terms = {}
+        for match in matches:
+            key = tuple(match)
+            if key in queries:
+                continue
+            # the terms may be numbers, e.g. match=[12]
+            terms[key] = [str(i) for i in match]
+            if mode:
+                queries[key] = ExactMatch(terms[key] if match else [''], mode)
+            else:
+                queries[key] = self.match_regex(match, default_regex)
+
+        scan = [key for key, rc in queries.items() if rc.search('')]
+        found = dict(zip(scan, self.scan_cells(cache, [queries[key] for key in scan], search_direction)))
+        for key, rc in queries.items():
+            if key in found:
+                continue
+            plain = not any(c in REGEX_SPECIAL for i in terms[key] for c in i)
+            if mode:
+                offsets = cache.value_index().find_exact(terms[key], mode)
+            elif default_regex in self.EXACT_REGEX and plain:
+                # '$' match before a trailing newline too
+                keys = [i for i in terms[key] if i] + [i + '\n' for i in terms[key] if i]
+                offsets = cache.value_index().find_exact(keys, 'casefold', rc)
+            else:
+                words = [i for i in terms[key] if i] if default_regex in self.INDEXED_REGEX and plain else None
+                offsets = cache.value_index().find(rc, words)
+            found[key] = cache.match_cells(offsets, search_direction)
+
+        result = {}
+        for key in queries:
+            logger.debug("find: {}".format(found[key]))
+            result[key] = self.match_spans(found[key], search_direction)
+            logger.debug ("lookup_match result: {}".format(result[key]))
+        return result
 
+    """
+    lookup_match streamed, the worksheet is fetched block_rows rows at a time and
+    the GridIndex are yielded as soon as they are complete (not sorted by length),
+    memory is bounded by a block and the values cache is not used nor filled.
+    the empty cells are the ones of the worksheet grid (col_count x row_count)
+    instead of the used range only
+        for m in gs.lookup_match_iter (match=['Diana', 'Yana'], search_direction='x'):
+            print (m)
+    """
+    def lookup_match_iter (self, match=[], search_direction='col', default_regex=r"\b({})\b", mode=None,
+                           block_rows=5000):
+        assert self.worksheet_cursor, "worksheet not open"
+        rc = ExactMatch([str(i) for i in match] if match else [''], mode) if mode else self.match_regex(match, default_regex)
+        empty_match = bool(rc.search(''))
+        right = search_direction in ('col', 'x')
+        down = search_direction in ('row', 'y')
+        self.flush()
+        # the cursor may move between two blocks
+        worksheet = self.worksheet_cursor
+        cols = worksheet.col_count
+        rows = worksheet.row_count
+        spans = MatchSpans(search_direction)
+        # last collected cell (col, row)
+        last = None
+        for r0 in range(1, rows + 1, block_rows):
+            r1 = min(r0 + block_rows - 1, rows)
+            data = worksheet.get_values(range_name="{}:{}".format(r0, r1))
+            logger.debug ("lookup_match_iter rows {}:{} {}".format(r0, r1, len(data)))
+            hit = {}
+            for row in range(r0, r1 + 1):
+                line = data[row - r0] if row - r0 < len(data) else []
+                width = max(cols, len(line))
+                hits = []
+                for col, value in enumerate(line, 1):
+                    if value:
+                        h = hit.get(value)
+                        if h is None:
+                            h = hit[value] = bool(rc.search(value))
+                        if h:
+                            hits.append(col)
+                    elif empty_match:
+                        hits.append(col)
+                if empty_match:
+                    hits.extend(range(len(line) + 1, width + 1))
+                empty = lambda c: c > len(line) or line[c - 1] == ''
+
+                # the row-major scan of lookup_match: a match, or an empty cell right
+                # after (search_direction col) or below (row) the last collected cell
+                collected = []
+                chain = last[0] if down and last and last[1] == row - 1 else None
+                for i, col in enumerate(hits):
+                    if chain is not None:
+                        if chain < col and empty(chain):
+                            collected.append(chain)
+                        chain = None
+                    collected.append(col)
+                    if right:
+                        nxt = hits[i + 1] if i + 1 < len(hits) else width + 1
+                        c = col + 1
+                        while c < nxt and empty(c):
+                            collected.append(c)
+                            c += 1
+                if chain is not None and chain <= width and empty(chain):
+                    collected.append(chain)
+                if collected:
+                    last = (collected[-1], row)
+                for col in collected:
+                    for grid_index in spans.add(col, row):
+                        yield grid_index
+        for grid_index in spans.close():
+            yield grid_index
+
+    """
+    the compiled regex of a lookup_match match list
+    """
+    def match_regex (self, match, default_regex=r"\b({})\b"):
         rs = ""
         for i in match[:-1]:
             rs += default_regex.format(i) + "|" if i else ''
         rs += default_regex.format(match[-1]) if match and match[-1] else '(^$)'
         logger.info ("r: {}".format(rs))
-        rc = compile(rs, IGNORECASE)
+        return compile(rs, IGNORECASE)
 
-        cell_find_list = []
-        for i in self.data_cache.cache_cells:
-            for j in i:
+    """
+    row-major scan of all the cached cells collecting for each regex of rc_list the
+    matching cells and the runs of empty cells following a match in search_direction
+    """
+    def scan_cells (self, cache, rc_list, search_direction='col'):
+        found = [[] for rc in rc_list]
+        if not rc_list:
+            return found
+        for j in cache.cells():
+            for rc, cell_find_list in zip(rc_list, found):
                 if rc.search (j.value):
                     cell_find_list.append (j)
                 elif j.value == '':
@@ -575,8 +1005,13 @@ class GoogleSheets(object):
                     elif cell_find_list and search_direction in ('row', 'y') and (
                             cell_find_list[-1].col == j.col and cell_find_list[-1].row == j.row - 1):
                         cell_find_list.append (j)
+        return found
 
-        logger.debug("find: {}".format(cell_find_list))
+    """
+    group the found cells into GridIndex runs of adjacent cells, sorted by length
+    in search_direction (longest at the end)
+    """
+    def match_spans (self, cell_find_list, search_direction='col'):
         if search_direction.lower() in ('col', 'x'):
             cell_find_list.sort(key=lambda x: (int(x.row), int(x.col)), reverse=False)
         else:
@@ -599,14 +1034,25 @@ class GoogleSheets(object):
             result.sort(key=lambda x: (x.end.col - x.start.col), reverse=False)
         else:
             result.sort(key=lambda x: (x.end.row - x.start.row), reverse=False)
-        logger.debug ("lookup_match result: {}".format(result))
         return result
 
+    """
+    NumPy view (GridView) of the cached values of the active worksheet, require numpy
+    """
+    def grid_view (self):
+        assert self.worksheet_cursor, "worksheet not open"
+        return GridView(self, self.cached_data())
+
     """
     get values from column col (start index 1)
     """
     def get_values_col (self, col, **kwargs):
         assert self.worksheet_cursor, "worksheet not open"
+        cache = self.fresh_cache(col, 1, col, None, **kwargs)
+        if cache:
+            result = [row[0] if row else '' for row in cache.slice(col, 1, col, cache.rows)]
+            return result
+        self.flush()
         result = self.worksheet_cursor.col_values(col, **kwargs)
         return result
 
@@ -615,6 +1061,11 @@ class GoogleSheets(object):
     """
     def get_values_row (self, row, **kwargs):
         assert self.worksheet_cursor, "worksheet not open"
+        cache = self.fresh_cache(1, row, None, row, **kwargs)
+        if cache:
+            result = cache.slice(1, row, cache.cols, row)
+            return result[0] if result else []
+        self.flush()
         result = self.worksheet_cursor.row_values(row, **kwargs)
         return result
 
@@ -626,41 +1077,115 @@ class GoogleSheets(object):
     def get_values (self, grid_index=None, **kwargs):
         assert self.worksheet_cursor, "worksheet not open"
         if isinstance(grid_index, GridIndex):
-            s = rowcol_to_a1(col=grid_index.start.col, row=grid_index.start.row)
-            e = rowcol_to_a1(col=grid_index.end.col,   row=grid_index.end.row)
-            range_name = "{}:{}".format(s, e)
+            rect = (grid_index.start.col, grid_index.start.row, grid_index.end.col, grid_index.end.row)
         elif isinstance(grid_index, tuple) and len(grid_index) == 4:
-            s = rowcol_to_a1(col=grid_index[0], row=grid_index[1])
-            e = rowcol_to_a1(col=grid_index[2], row=grid_index[3])
+            rect = grid_index
+        else:
+            rect = None
+        cache = self.fresh_cache(*(rect if rect else (1, 1, None, None)), **kwargs)
+        if cache:
+            result = cache.slice(*rect) if rect else cache.slice(1, 1, cache.cols, cache.rows)
+            return result
+        if rect:
+            s = rowcol_to_a1(col=rect[0], row=rect[1])
+            e = rowcol_to_a1(col=rect[2], row=rect[3])
             range_name = "{}:{}".format(s, e)
         else:
             range_name = None
+        self.flush()
         result = self.worksheet_cursor.get_values(range_name=range_name, **kwargs)
         return result
 
+    """
+    values of every range of grid_indexes (GridIndex or (start_col, start_row, end_col, end_row)),
+    a list in the grid_indexes order. the ranges the cache covers are read from it, the
+    others are fetched with values.batchGet (one request per BATCH_GET_MAX_URL of ranges),
+    the fetched formatted values refresh the stale ranges of the cache they hold
+        for m, values in zip(match_location, gs.get_values_many(match_location)):
+    """
+    def get_values_many (self, grid_indexes, **kwargs):
+        assert self.worksheet_cursor, "worksheet not open"
+        rects = []
+        for grid_index in grid_indexes:
+            if isinstance(grid_index, GridIndex):
+                rects.append((grid_index.start.col, grid_index.start.row, grid_index.end.col, grid_index.end.row))
+            elif isinstance(grid_index, tuple) and len(grid_index) == 4:
+                rects.append(tuple(grid_index))
+            else:
+                raise ValueError ("grid_index {}".format(grid_index))
+        result = {}
+        fetch = []
+        for rect in rects:
+            if rect in result or rect in fetch:
+                continue
+            cache = self.fresh_cache(*rect, **kwargs)
+            if cache:
+                result[rect] = cache.slice(*rect)
+            else:
+                fetch.append(rect)
+        if fetch:
+            self.flush()
+            title = quote(self.worksheet_cursor.title)
+            chunks = [[]]
+            size = 0
+            for rect in fetch:
+                length = len(title) + len(quote(a1_range(*rect))) + 16
+                if chunks[-1] and size + length > self.BATCH_GET_MAX_URL:
+                    chunks.append([])
+                    size = 0
+                chunks[-1].append(rect)
+                size += length
+            for chunk in chunks:
+                logger.debug ("get_values_many {} ranges".format(len(chunk)))
+                values = self.worksheet_cursor.values_batch_get([a1_range(*rect) for rect in chunk], **kwargs)
+                result.update(zip(chunk, values))
+            if not kwargs or kwargs == {'value_render_option': ValueRenderOption.formatted}:
+                cache = self.data_cache
+                for stale in list(cache.stale):
+                    for rect in fetch:
+                        if rect[0] <= stale[0] and rect[1] <= stale[1] and stale[2] <= rect[2] and stale[3] <= rect[3]:
+                            data = result[rect][stale[1] - rect[1]:stale[3] - rect[1] + 1]
+                            cache.refresh(stale, [row[stale[0] - rect[0]:stale[2] - rect[0] + 1] for row in data])
+                            break
+        return [result[rect] for rect in rects]
+
     """
     delete cols from start to end
     """
     def delete_cols(self, start_index, end_index=None):
         assert self.worksheet_cursor, "worksheet not open"
+        self.flush()
+        self.check_version(self.spreadsheet_cursor.id)
         self.worksheet_cursor.delete_columns(start_index, end_index=end_index)
-        self.data_cache.close()
+        self.data_cache.delete_cols(start_index, end_index=end_index)
+        self.written(self.spreadsheet_cursor.id)
 
     """
     delete rows from start to end
     """
     def delete_rows(self, start_index, end_index=None):
         assert self.worksheet_cursor, "worksheet not open"
+        self.flush()
+        self.check_version(self.spreadsheet_cursor.id)
         self.worksheet_cursor.delete_rows(start_index, end_index=end_index)
-        self.data_cache.close()
+        self.data_cache.delete_rows(start_index, end_index=end_index)
+        self.written(self.spreadsheet_cursor.id)
 
     """
     update a single cell value
     """
     def update_cell(self, col, row, value):
         assert self.worksheet_cursor, "worksheet not open"
+        if self.write_batch is not None:
+            self.write_batch.write(self.worksheet_cursor, [(col, row, value)], ValueInputOption.user_entered)
+            self.data_cache.write([(col, row, value)], ValueInputOption.user_entered)
+            if self.write_batch.full():
+                self.flush()
+            return
+        self.check_version(self.spreadsheet_cursor.id)
         self.worksheet_cursor.update_cell(col=col, row=row, value=value)
-        self.data_cache.close()
+        self.data_cache.write([(col, row, value)], ValueInputOption.user_entered)
+        self.written(self.spreadsheet_cursor.id)
 
     """
     Clears multiple ranges in one API call
@@ -671,25 +1196,35 @@ class GoogleSheets(object):
     def clear (self, grid_index=[], **kwargs):
         assert self.worksheet_cursor, "worksheet not open"
         range_list = []
+        rect_list = []
         for grid_idx in grid_index:
             if isinstance(grid_idx, GridIndex):
-                s = rowcol_to_a1(col=grid_idx.start.col, row=grid_idx.start.row)
-                e = rowcol_to_a1(col=grid_idx.end.col,   row=grid_idx.end.row)
-                range_list.append("{}:{}".format(s, e))
+                rect = (grid_idx.start.col, grid_idx.start.row, grid_idx.end.col, grid_idx.end.row)
             elif isinstance(grid_idx, tuple) and len(grid_idx) == 4:
-                s = rowcol_to_a1(col=grid_idx[0], row=grid_idx[1])
-                e = rowcol_to_a1(col=grid_idx[2], row=grid_idx[3])
-                range_list.append("{}:{}".format(s, e))
+                rect = grid_idx
             elif isinstance(grid_idx, tuple) and len(grid_idx) == 2:
-                s = rowcol_to_a1(col=grid_idx[0], row=grid_idx[1])
-                range_list.append("{}:{}".format(s, s))
+                rect = (grid_idx[0], grid_idx[1], grid_idx[0], grid_idx[1])
             elif isinstance(grid_idx, CellIndex):
-                s = rowcol_to_a1(col=grid_idx.col, row=grid_idx.row)
-                range_list.append("{}:{}".format(s, s))
+                rect = (grid_idx.col, grid_idx.row, grid_idx.col, grid_idx.row)
             else:
                 raise ValueError ("clear idx {}".format(grid_idx))
+            s = rowcol_to_a1(col=rect[0], row=rect[1])
+            e = rowcol_to_a1(col=rect[2], row=rect[3])
+            range_list.append("{}:{}".format(s, e))
+            rect_list.append(rect)
+        cache = self.data_cache
+        if self.write_batch is not None:
+            self.write_batch.clear(self.worksheet_cursor, rect_list)
+            for rect in rect_list:
+                cache.clear_range(*rect)
+            if self.write_batch.full():
+                self.flush()
+            return None
+        self.check_version(self.spreadsheet_cursor.id)
         result = self.worksheet_cursor.batch_clear(ranges=range_list, **kwargs)
-        self.data_cache.close()
+        for rect in rect_list:
+            cache.clear_range(*rect)
+        self.written(self.spreadsheet_cursor.id)
         return result
 
     """
@@ -707,9 +1242,25 @@ class GoogleSheets(object):
     gs.update_cells(cells_index=(col:7, row=4),
                     values=[[1, 8, 6, 4, 2]])
     KO use transpose=True or pass the data as : [[1], [8], [6], [4], [2]]
+
+    diff=True only send the cells whose value differ from the cached (formatted)
+    values, grouped into ranges (merge_dirty) sent with one values.batchUpdate,
+    a cell showing the same value (e.g. the result of a formula) is not rewritten.
+    numbers are compared as the automatic format display them (42, 1.5), a number
+    in a cell with its own number format (currency, percent, date) is always sent
+
+    a payload over max_bytes (json) or max_cells (default UPDATE_MAX_BYTES,
+    UPDATE_MAX_CELLS) is split by row blocks sent concurrently (UPDATE_WORKERS),
+    each one retried on its own, the result is then
+    {'spreadsheetId': ..., 'updatedCells': total, 'responses': [per request]}
+    and if a request still fail the others are kept, its range is marked unknown
+    in the cache and the error raised.
+    kwargs (includeValuesInResponse, responseValueRenderOption...) are sent with
+    every request, a batch() session doesn't accept them
     """
     def update_cells(self, cells_index, values, transpose=False,
-                     value_input_option=ValueInputOption.user_entered,**kwargs):
+                     value_input_option=ValueInputOption.user_entered, diff=False,
+                     max_bytes=None, max_cells=None, **kwargs):
         assert self.worksheet_cursor, "worksheet not open"
         start_col = 0
         start_row = 0
@@ -727,19 +1278,138 @@ class GoogleSheets(object):
         s = rowcol_to_a1(col=start_col, row=start_row)
         if  isinstance(cells_index, GridIndex):
             e = rowcol_to_a1(col=cells_index.end.col, row=cells_index.end.row)
+            end_col = cells_index.end.col
+            # the values fill the GridIndex row by row
+            width = cells_index.end.col - start_col + 1
+            flat = [v for c in values for v in c]
+            if len(flat) > width * (cells_index.end.row - start_row + 1):
+                raise ValueError ("{} values for {}".format(len(flat), cells_index))
+            values = [flat[i:i + width] for i in range(0, len(flat), width)]
+        else:
+            values = [list(sublist) for sublist in list(zip(*values))] if transpose else [list(c) for c in values]
+            if values:
+                end_col = max(map(len, values)) + start_col - 1
+                e = rowcol_to_a1(col=end_col, row=len (values) + start_row - 1)
+        if not values:
+            return None
+        cells = [(start_col + c, start_row + r, v) for r, row in enumerate(values) for c, v in enumerate(row)]
+        if diff:
+            dirty = dict(((c, r), v) for c, r, v in self.cached_data().changed(cells, value_input_option))
+            if not dirty:
+                return None
+            clean = dict(((c, r), v) for c, r, v in cells if v is not None and (c, r) not in dirty)
+            rect_list, send = merge_dirty(dirty, clean)
+            logger.debug ("update_cells diff {}/{} cells in {} ranges".format(len(dirty), len(cells), len(rect_list)))
+            cells = [(c, r, v) for (c, r), v in send.items()]
+        if self.write_batch is not None:
+            if kwargs:
+                raise ValueError ("update_cells {} can't be queued in a batch session".format(sorted(kwargs)))
+            self.write_batch.write(self.worksheet_cursor, cells, value_input_option)
+            self.data_cache.write(cells, value_input_option)
+            if self.write_batch.full():
+                self.flush()
+            return None
+        max_bytes = self.UPDATE_MAX_BYTES if max_bytes is None else max_bytes
+        max_cells = self.UPDATE_MAX_CELLS if max_cells is None else max_cells
+        # (A1 range, values, rectangle)
+        if diff:
+            data = [(a1_range(c0, r0 + i, c1, r0 + i + len(block) - 1), block, (c0, r0 + i, c1, r0 + i + len(block) - 1))
+                    for c0, r0, c1, r1 in rect_list
+                    for i, block in row_blocks([[send[(c, r)] for c in range(c0, c1 + 1)] for r in range(r0, r1 + 1)],
+                                               max_bytes, max_cells)]
         else:
-            values = [list(sublist) for sublist in list(zip(*values))] if transpose else values
-            e = rowcol_to_a1(col=max(map(len, values)) + start_col - 1, row=len (values) + start_row - 1)
-        range_name = "{}:{}".format(s, e)
-        cell_list = self.worksheet_cursor.range(range_name)
-        idx=0
-        for c in values:
-            for v in c:
-                cell_list[idx].value = v
-                idx += 1
-        result = self.worksheet_cursor.update_cells(
-            cell_list=cell_list, value_input_option=value_input_option, **kwargs)
-        self.data_cache.close()
+            blocks = list(row_blocks(values, max_bytes, max_cells))
+            if len(blocks) == 1:
+                data = [("{}:{}".format(s, e), values, (start_col, start_row, end_col, start_row + len(values) - 1))]
+            else:
+                data = [(a1_range(start_col, start_row + i, end_col, start_row + i + len(block) - 1), block,
+                         (start_col, start_row + i, end_col, start_row + i + len(block) - 1)) for i, block in blocks]
+        groups = list(range_groups(data, max_bytes, max_cells))
+        worksheet = self.worksheet_cursor
+
+        def send(group):
+            if len(group) > 1:
+                return worksheet.values_batch_update([item[:2] for item in group], value_input_option=value_input_option,
+                                                     **kwargs)
+            return worksheet.values_update(group[0][0], group[0][1], value_input_option=value_input_option, **kwargs)
+
+        self.check_version(self.spreadsheet_cursor.id)
+        if len(groups) == 1:
+            result = send(groups[0])
+            self.data_cache.write(cells, value_input_option)
+            self.written(self.spreadsheet_cursor.id)
+            return result
+        logger.debug ("update_cells {} cells in {} requests".format(len(cells), len(groups)))
+        # the workers draw on the attempt budget of the caller (single attempt under AsyncGoogleSheets)
+        budget = current_budget()
+
+        def send_shared(group):
+            with shared_budget(budget):
+                return send(group)
+
+        with ThreadPoolExecutor(max_workers=min(self.UPDATE_WORKERS, len(groups))) as executor:
+            futures = [executor.submit(copy_context().run, send_shared, group) for group in groups]
+        responses, error = [], None
+        self.data_cache.write(cells, value_input_option)
+        for group, future in zip(groups, futures):
+            if future.exception() is None:
+                responses.append(future.result())
+                continue
+            error = error or future.exception()
+            for item in group:
+                self.data_cache.invalidate(*item[2])
+        self.written(self.spreadsheet_cursor.id)
+        if error is not None:
+            raise error
+        return {'spreadsheetId': self.spreadsheet_cursor.id,
+                'updatedCells': sum(r.get('updatedCells', r.get('totalUpdatedCells', 0)) for r in responses if r),
+                'responses': responses}
+
+    """
+    append the rows of an iterable (consumed lazily, e.g. a generator) after the
+    table found at table_range, batch_rows rows per values.append request, the
+    sheet grows as needed. no read is needed to find the last row and the rows
+    of concurrent writers are not overwritten.
+    insert_data_option: 'INSERT_ROWS' insert rows for the new data,
+                        'OVERWRITE' write the rows below the table
+    pending batch() writes are sent first, the appends are never queued.
+    return {'spreadsheetId': ..., 'updatedRows': total, 'updatedCells': total,
+            'updatedRange': range of the last request}
+    """
+    def append_rows(self, rows, batch_rows=1000, table_range='A1',
+                    value_input_option=ValueInputOption.user_entered, insert_data_option='INSERT_ROWS', **kwargs):
+        assert self.worksheet_cursor, "worksheet not open"
+        assert batch_rows > 0, "batch_rows must be positive"
+        self.flush()
+        key = (self.spreadsheet_cursor.id, self.worksheet_cursor.id)
+        result = {'spreadsheetId': self.spreadsheet_cursor.id, 'updatedRows': 0, 'updatedCells': 0, 'updatedRange': None}
+        rows = iter(rows)
+        self.check_version(self.spreadsheet_cursor.id)
+        while True:
+            values = [list(row) for row in islice(rows, batch_rows)]
+            if not values:
+                break
+            response = self.worksheet_cursor.values_append(
+                table_range, values, value_input_option=value_input_option,
+                insert_data_option=insert_data_option, **kwargs)
+            updates = response.get('updates', {}) if response else {}
+            logger.debug ("append_rows {} rows at {}".format(len(values), updates.get('updatedRange')))
+            cache = self.data_cache
+            if not updates.get('updatedRange'):
+                self.cache_store.discard(key)
+            else:
+                start_col, start_row, end_col, end_row = range_rect(updates['updatedRange'])
+                if insert_data_option == 'INSERT_ROWS' and start_row < cache.start_row + cache.rows:
+                    # the rows below the table were shifted down
+                    self.cache_store.discard(key)
+                else:
+                    cache.write(((start_col + c, start_row + r, v)
+                                 for r, row in enumerate(values) for c, v in enumerate(row)), value_input_option)
+                result['updatedRange'] = updates['updatedRange']
+            result['updatedRows'] += updates.get('updatedRows', 0)
+            result['updatedCells'] += updates.get('updatedCells', 0)
+        if result['updatedRows']:
+            self.written(self.spreadsheet_cursor.id)
         return result
 
     """
@@ -753,15 +1423,15 @@ class GoogleSheets(object):
         for w in self.worksheets():
             logger.info ("s {} w {}".format(t, w))
             self.open(tab_id=w.id)
-            match_location = self.lookup_match (match=['#REF!'], default_regex=r"^{}$")
-            for m in match_location:
+            match_location = self.lookup_match (match=['#REF!'], mode='exact')
+            values = self.get_values_many(match_location, value_render_option=ValueRenderOption.formula)
+            for m, v in zip(match_location, values):
                 logger.info ("refresh {}: {}".format(w, m))
-                v = self.get_values(m, value_render_option=ValueRenderOption.formula)
                 try:
                     self.update_cells (m, v, value_input_option=ValueInputOption.user_entered)
                 except Exception as e:
                     logger.warning ("refresh_ref {}".format(e))
-            match_location = self.lookup_match (match=['#REF!'], default_regex=r"^{}$")
+            match_location = self.lookup_match (match=['#REF!'], mode='exact')
             for m in match_location:
                 ref_count += 1
                 logger.warning ("refresh ref unresolved {} {}".format(w, m))
@@ -863,7 +1533,12 @@ class GoogleSheets(object):
         body.update ({'responseRanges': []})
         body.update ({'responseIncludeGridData': False})
         logger.debug ("apply_cells_user_format: {}".format(body))
+        self.check_version(self.spreadsheet_cursor.id)
         result = self.spreadsheet_cursor.batch_update(body)
         logger.info (result)
+        self.written(self.spreadsheet_cursor.id)
         self.placeholder = []
         return result
+
+from .async_sheets import AsyncGoogleSheets
+from .grid_view import GridView
@@ -0,0 +1,151 @@
+"""
+asyncio facade around GoogleSheets
+
+each AsyncGoogleSheets drive one GoogleSheets, the blocking calls are sent
+to a thread pool executor and the retry (async_retry) is driven from the
+event loop with asyncio.sleep, so one loop may work on hundreds of
+spreadsheets concurrently. an error is retried from the loop only if the
+retried call raising it retry it (e.g. a 403 on a Sheets call is not).
+CellIndex, GridIndex and CellFormat are the same objects as with GoogleSheets.
+
+usage:
+    async def main():
+        ags = AsyncGoogleSheets()
+        await ags.open(title='demo', tab_name='lookup')
+        match_location = await ags.lookup_match(match=['Diana', 'Yana'])
+        for m, values in zip(match_location, await ags.get_values_many(match_location)):
+            print (m, values)
+
+    asyncio.run(main())
+"""
+
+import asyncio
+import logging
+from functools import partial
+from . import GoogleSheets
+from .retry import async_retry, single_attempt
+
+logger = logging.getLogger('AsyncGoogleSheets')
+
+def _async_method(name):
+    async def method(self, *args, **kwargs):
+        return await self._run(getattr(self.gs, name), *args, **kwargs)
+    method.__name__ = name
+    method.__qualname__ = "AsyncGoogleSheets.{}".format(name)
+    # retried on the errors the underlying retried calls retry
+    return async_retry(tries=15, delay=2, backoff=2, except_retry=None)(method)
+
+"""
+method run in the executor without single_attempt nor retry from the loop, for
+the calls sending several changes that must not be run again as a whole, each
+request is retried by its own retried call
+"""
+def _async_call(name):
+    async def method(self, *args, **kwargs):
+        return await self._execute(partial(getattr(self.gs, name), *args, **kwargs))
+    method.__name__ = name
+    method.__qualname__ = "AsyncGoogleSheets.{}".format(name)
+    return method
+
+class AsyncGoogleSheets(object):
+
+    AlreadyExists = GoogleSheets.AlreadyExists
+    NotFound = GoogleSheets.NotFound
+    InitError = GoogleSheets.InitError
+
+    """
+    gs: an existing GoogleSheets to drive, otherwise one is created with kwargs
+    executor: concurrent.futures executor for the blocking calls, default to the loop one
+    """
+    def __init__(self, gs=None, executor=None, **kwargs):
+        self.gs = gs if gs is not None else GoogleSheets(**kwargs)
+        self.executor = executor
+        # GoogleSheets keep a spreadsheet/worksheet cursor, one call at a time
+        self.lock = asyncio.Lock()
+
+    def __repr__(self):
+        return "<{} {}>".format(self.__class__.__name__, self.gs.spreadsheet_cursor)
+
+    @staticmethod
+    def _single_attempt(fn, *args, **kwargs):
+        with single_attempt():
+            return fn(*args, **kwargs)
+
+    async def _run(self, fn, *args, **kwargs):
+        return await self._execute(partial(self._single_attempt, fn, *args, **kwargs))
+
+    async def _execute(self, call):
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            return await loop.run_in_executor(self.executor, call)
+
+    def spreadsheet_id(self):
+        return self.gs.spreadsheet_id()
+
+    def spreadsheet_title(self):
+        return self.gs.spreadsheet_title()
+
+    def is_open(self):
+        return self.gs.is_open()
+
+    def close(self):
+        return self.gs.close()
+
+    create = _async_method('create')
+    open = _async_method('open')
+    delete_spreadsheet = _async_method('delete_spreadsheet')
+    worksheets = _async_method('worksheets')
+    add_worksheet = _async_method('add_worksheet')
+    delete_worksheet = _async_method('delete_worksheet')
+    resize = _async_method('resize')
+    revision_list = _async_method('revision_list')
+    revision_list_mtime = _async_method('revision_list_mtime')
+    file_export = _async_method('file_export')
+    file_delete = _async_method('file_delete')
+    lookup_match = _async_method('lookup_match')
+    lookup_match_many = _async_method('lookup_match_many')
+    grid_view = _async_method('grid_view')
+    get_values = _async_method('get_values')
+    get_values_many = _async_method('get_values_many')
+    get_values_col = _async_method('get_values_col')
+    get_values_row = _async_method('get_values_row')
+    delete_cols = _async_method('delete_cols')
+    delete_rows = _async_method('delete_rows')
+    update_cell = _async_method('update_cell')
+    update_cells = _async_method('update_cells')
+    # the appended batches are not sent again
+    append_rows = _async_call('append_rows')
+    clear = _async_method('clear')
+    refresh_ref = _async_method('refresh_ref')
+    get_cell_user_format = _async_method('get_cell_user_format')
+    get_cells_user_format = _async_method('get_cells_user_format')
+    apply_cells_user_format = _async_method('apply_cells_user_format')
+
+    """
+    async generator of GoogleSheets.lookup_match_iter, every block is fetched
+    in the executor (and retried there)
+    """
+    async def lookup_match_iter(self, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        it = self.gs.lookup_match_iter(*args, **kwargs)
+        while True:
+            async with self.lock:
+                grid_index = await loop.run_in_executor(self.executor, next, it, None)
+            if grid_index is None:
+                return
+            yield grid_index
+
+    def prepare_cells_user_format (self, grid_index, cell_format):
+        self.gs.prepare_cells_user_format(grid_index, cell_format)
+
+    """
+    upload content of file descripor fd on success return a new AsyncGoogleSheets if return_object == True
+    else a file ressource id
+    """
+    @async_retry(tries=15, delay=2, backoff=2, except_retry=None)
+    async def file_upload(self, fd, title='', mime_type=None, extension=None, return_object=True):
+        result = await self._run(self.gs.file_upload, fd, title=title, mime_type=mime_type,
+                                 extension=extension, return_object=return_object)
+        if return_object:
+            return AsyncGoogleSheets(gs=result, executor=self.executor)
+        return result
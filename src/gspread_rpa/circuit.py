@@ -0,0 +1,128 @@
+"""
+circuit breaker per endpoint family
+
+when Google has an outage, retrying every call independently only block the
+workers, after failure_threshold consecutive outage failures (5xx, connection
+errors, timeouts) the circuit of the family open and the calls
+fail fast with CircuitOpenError until reset_timeout seconds have passed,
+then a single trial call is let through (half-open) and close the circuit
+on success or open it again on failure. any other HTTP answer, a 429 rate
+limit included, count as a success: the throttling is left to the retry backoff.
+
+families used by gspreadsheet_retry:
+    'sheets_values', 'sheets_batch_update', 'drive_files', 'drive_revisions'
+"""
+
+import time
+import threading
+import logging
+
+logger = logging.getLogger('circuit')
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker(object):
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60):
+        assert failure_threshold > 0, "failure_threshold must be greater than 0"
+        assert reset_timeout > 0, "reset_timeout must be greater than 0"
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.trial_at = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{} name:{} state:{} failures:{}>".format(
+            self.__class__.__name__,
+            self.name,
+            self.state,
+            self.failures)
+
+    """
+    None if a call may not be sent, otherwise True if it is the half-open trial call.
+    in half-open state only one trial call is allowed, a trial neither reported
+    nor released within reset_timeout is given to the next call
+    """
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+                logger.info ("circuit {} half-open".format(self.name))
+                self.state = self.HALF_OPEN
+                self.trial = False
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.HALF_OPEN and (not self.trial or now - self.trial_at >= self.reset_timeout):
+                self.trial = True
+                self.trial_at = now
+                return True
+            return None
+
+    """
+    return True if a call may be sent
+    """
+    def allow(self):
+        return self.acquire() is not None
+
+    """
+    give back the half-open trial of a call that didn't reach the endpoint
+    """
+    def release(self):
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.trial = False
+
+    def success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info ("circuit {} closed".format(self.name))
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning ("circuit {} open after {} failures".format(self.name, self.failures))
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+    """
+    raise CircuitOpenError if the circuit doesn't allow the call, return True
+    if the call is the half-open trial, it must then be reported or released
+    """
+    def check(self):
+        trial = self.acquire()
+        if trial is None:
+            raise CircuitOpenError ("circuit {} open, retry in {:.0f}s".format(
+                self.name, max(0, self.reset_timeout - (time.monotonic() - (self.opened_at or 0)))))
+        return trial
+
+"""
+process wide breakers by family name
+"""
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def circuit_breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+def configure_circuit(name, failure_threshold=5, reset_timeout=60):
+    with _breakers_lock:
+        _breakers[name] = CircuitBreaker(name, failure_threshold=failure_threshold, reset_timeout=reset_timeout)
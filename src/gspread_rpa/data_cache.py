@@ -0,0 +1,733 @@
+import sys
+import re
+import json
+import time
+import logging
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger('DataCache')
+
+"""
+compact worksheet values cache
+
+the grid is stored row-major as an array of 32 bits ids into a table of
+distinct (interned) strings, a 200k cells sheet cost ~800KB of ids plus its
+distinct values instead of one gspread.Cell object per cell.
+CachedCell views are only built on demand (cells(), cell())
+
+the cache is write-through, the GoogleSheets mutators patch it with the
+values they sent, the cells whose rendered value can't be known
+(USER_ENTERED strings the sheet parse as formulas, numbers, dates or
+booleans) are kept as stale ranges to be fetched again.
+numbers are cached as the sheet automatic format display them (1234.5,
+not 1,234.50): a cell with its own number format (currency, percent,
+date...) is then cached with its unformatted value until fetched again.
+
+lookups go through a ValueIndex built on first use: the positions of every
+distinct value and the distinct values holding every word token, a pattern
+is matched once per distinct value instead of once per cell.
+"""
+
+# USER_ENTERED strings parsed by the sheet, their display depends on the cell format
+_parsed_number = re.compile(r"^[-+(]?\s*[$\u20ac\u00a3\u00a5]?\s*[-+]?[\d,\s]*\.?\d*(e[-+]?\d+)?\s*%?\s*[$\u20ac\u00a3\u00a5]?\s*\)?$", re.IGNORECASE)
+_parsed_date = re.compile(r"^(\d{1,4}([-/.]\d{1,2}){1,2}([-/.]\d{1,4})?)?\s*(t?\d{1,2}(:\d{1,2}){1,2}(\.\d+)?)?\s*([ap]\.?m\.?)?$", re.IGNORECASE)
+_parsed_month = re.compile(r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\b\.?", re.IGNORECASE)
+_plain_decimal = re.compile(r"^-?\d+\.\d{1,10}$")
+_word = re.compile(r"\w+")
+
+"""
+case insensitive key of value, the values equal for re.IGNORECASE have the same key
+(casefold except the dotted and dotless i, both mapped to i by re)
+"""
+def fold(value):
+    return value.replace('\u0130', 'i').replace('\u0131', 'i').casefold()
+
+"""
+the case insensitive word tokens of value
+"""
+def tokens(value):
+    return _word.findall(fold(value))
+
+class ExactMatch(object):
+    """
+    whole value equality with one of keys, as is (mode 'exact') or case insensitive
+    (mode 'casefold'), search(value) may be used in place of a compiled regex
+    """
+    def __init__(self, keys, mode='exact'):
+        assert mode in ('exact', 'casefold'), "unknown mode {}".format(mode)
+        self.mode = mode
+        self.keys = set(keys) if mode == 'exact' else set(fold(k) for k in keys)
+
+    def __repr__(self):
+        return "<{} {} {}>".format(
+            self.__class__.__name__,
+            self.mode,
+            self.keys)
+
+    def search(self, value):
+        return (value if self.mode == 'exact' else fold(value)) in self.keys
+
+"""
+a number as the automatic format display it, None if it would be rounded
+or shown in scientific notation
+"""
+def _number(value):
+    if isinstance(value, float) and not value.is_integer():
+        text = repr(value)
+        # inf, nan, exponent or more digits than displayed
+        if not _plain_decimal.match(text) or len(text.lstrip('-')) > 16:
+            return None
+        return text
+    value = int(value)
+    return str(value) if abs(value) < 10 ** 15 else None
+
+"""
+the value displayed by the sheet once value is written with value_input_option
+(as a string, like the FORMATTED_VALUE read back) or None if it can't be known
+"""
+def rendered_value(value, value_input_option='RAW'):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return _number(value)
+    value = str(value)
+    if value_input_option == 'RAW' or value == '':
+        return value
+    # USER_ENTERED, the value is parsed as if typed in the UI
+    if value.startswith("'"):
+        return value[1:]
+    if value.startswith(('=', '+', '-')) or value.strip().upper() in ('TRUE', 'FALSE'):
+        # formulas, a leading sign is parsed as a formula too (-A1, +x: #NAME?)
+        return None
+    if any(c.isdigit() for c in value):
+        text = value.strip()
+        if _parsed_number.match(text) or _parsed_date.match(text):
+            return None
+        if _parsed_month.search(text) and len(_parsed_month.sub('', text).strip(' ,.-/0123456789')) == 0:
+            return None
+    return value
+
+"""
+group a set of (col, row) into rectangles (start_col, start_row, end_col, end_row),
+runs of consecutive columns of a row, merged with the runs of the same columns
+of the following rows
+"""
+def cells_to_rectangles(cells):
+    runs = {}
+    for col, row in sorted(set(cells), key=lambda x: (x[1], x[0])):
+        line = runs.setdefault(row, [])
+        if line and line[-1][1] == col - 1:
+            line[-1][1] = col
+        else:
+            line.append([col, col])
+    result = []
+    opened = {}
+    for row in sorted(runs):
+        current = {}
+        for c0, c1 in runs[row]:
+            rect = opened.get((c0, c1))
+            if rect is not None and rect[3] == row - 1:
+                rect[3] = row
+            else:
+                rect = [c0, row, c1, row]
+                result.append(rect)
+            current[(c0, c1)] = rect
+        opened = current
+    return [tuple(r) for r in result]
+
+"""
+rectangles (as cells_to_rectangles) covering the dirty cells {(col, row): value},
+the gap of clean cells {(col, row): value} between two dirty runs of a row is
+sent too if its json size cost less than range_cost (the overhead of one more
+range), return the rectangles and the cells they cover
+"""
+def merge_dirty(dirty, clean, range_cost=64):
+    cells = dict(dirty)
+    rows = {}
+    for col, row in dirty:
+        rows.setdefault(row, []).append(col)
+    for row, cols in rows.items():
+        cols.sort()
+        for c0, c1 in zip(cols, cols[1:]):
+            if c1 == c0 + 1:
+                continue
+            gap = [(col, row) for col in range(c0 + 1, c1)]
+            if all(k in clean for k in gap) and sum(len(json.dumps(clean[k])) + 1 for k in gap) < range_cost:
+                cells.update((k, clean[k]) for k in gap)
+    return cells_to_rectangles(cells), cells
+
+"""
+the flat offsets a row-major scan of the grid ids (row-major, cols wide, 0 for empty)
+collect for the matching cells at the sorted offsets: every match followed by the
+run of empty cells on its right (search_direction 'col') or below it ('row') up to
+the next match
+"""
+def match_offsets(ids, cols, offsets, search_direction='col'):
+    right = search_direction in ('col', 'x')
+    if right:
+        step = 1
+    elif search_direction in ('row', 'y'):
+        step = cols
+    else:
+        step = None
+    found = []
+    for n, nxt in zip(offsets, offsets[1:] + [len(ids)]):
+        found.append(n)
+        q = n + step if step else nxt
+        while q < nxt and ids[q] == 0 and (not right or q % cols):
+            found.append(q)
+            q += step
+    return found
+
+class CachedCell(object):
+    __slots__ = ('row', 'col', 'value')
+
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+    def __repr__(self):
+        return "<{} R{}C{} {}>".format(
+            self.__class__.__name__,
+            self.row,
+            self.col,
+            repr(self.value))
+
+class ValueIndex(object):
+    """
+    inverted index of a DataCache
+    positions: value id -> flat offsets (row-major) of the cells holding it, '' is not indexed,
+               the offsets of the moved ids are appended and cleaned up on read
+    tokens: word token -> ids of the distinct values holding it
+    folded: fold(value) -> ids of the distinct values
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.table = cache.table
+        self.table_index = cache.table_index
+        self.positions = {}
+        for n, i in enumerate(cache.ids):
+            if i:
+                self.positions.setdefault(i, array('I')).append(n)
+        self.tokens = {}
+        self.folded = {}
+        for i, value in enumerate(self.table):
+            self.add_value(i, value)
+        # ids whose positions may hold offsets of cells that changed since
+        self.moved = set()
+        self.garbage = 0
+
+    def __repr__(self):
+        return "<{} values:{} tokens:{}>".format(
+            self.__class__.__name__,
+            len(self.positions),
+            len(self.tokens))
+
+    def add_value(self, i, value):
+        for token in set(tokens(value)):
+            self.tokens.setdefault(token, set()).add(i)
+        self.folded.setdefault(fold(value), set()).add(i)
+
+    """
+    the cell at offset n changed from value id old to new (cache.ids already updated)
+    """
+    def move(self, n, old, new):
+        if old == new:
+            return
+        if old:
+            self.moved.add(old)
+            self.garbage += 1
+        if new:
+            self.positions.setdefault(new, array('I')).append(n)
+            self.moved.add(new)
+        if self.garbage > len(self.cache.ids):
+            for i in list(self.moved):
+                self.offsets(i)
+
+    """
+    sorted flat offsets of the cells holding the value id i
+    """
+    def offsets(self, i):
+        if i in self.moved:
+            self.moved.discard(i)
+            ids = self.cache.ids
+            found = sorted(set(n for n in self.positions.get(i, ()) if n < len(ids) and ids[n] == i))
+            self.garbage -= len(self.positions.get(i, ())) - len(found)
+            if found:
+                self.positions[i] = array('I', found)
+            else:
+                self.positions.pop(i, None)
+        return self.positions.get(i, ())
+
+    """
+    ids of the distinct values holding all the word tokens of one of the terms,
+    None if a term has no word token (every value is a candidate)
+    """
+    def candidates(self, terms):
+        result = set()
+        for term in terms:
+            keys = tokens(term)
+            if not keys:
+                return None
+            found = sorted((self.tokens.get(k, set()) for k in set(keys)), key=len)
+            result.update(found[0].intersection(*found[1:]))
+        return result
+
+    """
+    sorted flat offsets of the non empty cells whose value is matched by rc (rc.search),
+    if terms is given every value matched by rc must hold all the word tokens of one of them
+    """
+    def find(self, rc, terms=None):
+        table = self.table
+        ids = self.candidates(terms) if terms is not None else None
+        if ids is None:
+            ids = range(1, len(table))
+        offsets = []
+        for i in ids:
+            if i and rc.search(table[i]):
+                offsets.extend(self.offsets(i))
+        offsets.sort()
+        return offsets
+
+    """
+    sorted flat offsets of the non empty cells whose value is one of keys, compared
+    as is (mode 'exact') or case insensitively ('casefold'), one hash lookup per key,
+    if rc is given the values must match it too
+    """
+    def find_exact(self, keys, mode='exact', rc=None):
+        ids = set()
+        for key in keys:
+            if mode == 'exact':
+                i = self.table_index.get(key)
+                if i:
+                    ids.add(i)
+            else:
+                ids.update(self.folded.get(fold(key), ()))
+        offsets = []
+        for i in ids:
+            if rc is None or rc.search(self.table[i]):
+                offsets.extend(self.offsets(i))
+        offsets.sort()
+        return offsets
+
+class DataCache(object):
+
+    def __init__(self):
+        self.close()
+
+    def expired(self):
+        return self._expired == True
+
+    def close(self):
+        self.table = ['']
+        self.table_index = {'': 0}
+        self.ids = array('I')
+        self.start_col = 1
+        self.start_row = 1
+        self.rows = 0
+        self.cols = 0
+        self.stale = []
+        # Drive version of the spreadsheet at fetch time, None once written by us
+        self.version = None
+        self.checked_at = None
+        self.index = None
+        # trailing rows or columns may have been emptied
+        self.ragged = False
+        self._expired = True
+
+    def _id(self, value):
+        value = '' if value is None else str(value)
+        i = self.table_index.get(value)
+        if i is None:
+            i = self.table_index[value] = len(self.table)
+            self.table.append(sys.intern(value))
+            if self.index is not None:
+                self.index.add_value(i, value)
+        return i
+
+    """
+    the ValueIndex of the cached values, built on first use and then
+    kept up to date by the write-through
+    """
+    def value_index(self):
+        if self.index is None:
+            self.index = ValueIndex(self)
+        return self.index
+
+    """
+    set the value id of the cell at offset n
+    """
+    def _set(self, n, i):
+        old = self.ids[n]
+        if not i and (n >= (self.rows - 1) * self.cols or n % self.cols == self.cols - 1):
+            self.ragged = True
+        self.ids[n] = i
+        if self.index is not None:
+            self.index.move(n, old, i)
+
+    """
+    store the matrix (list of list) data, data[0][0] being the cell (start_col, start_row)
+    short rows are padded with ''
+    if cols (the width of the matrix) is given, data may be any iterable of rows
+    and is consumed row by row
+    """
+    def store(self, data, start_col=1, start_row=1, version=None, cols=None):
+        self.close()
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.start_col = start_col
+        self.start_row = start_row
+        if cols is None:
+            cols = max(map(len, data)) if data else 0
+        self.cols = cols
+        ids = self.ids
+        for row in data:
+            ids.extend(self._id(v) for v in row)
+            ids.extend([0] * (cols - len(row)))
+            self.rows += 1
+        self._expired = False
+
+    """
+    relayout the grid to cover at least cols, rows
+    """
+    def _grow(self, cols, rows):
+        if cols > self.cols:
+            # the offsets change
+            self.index = None
+            ids = array('I')
+            pad = [0] * (cols - self.cols)
+            for r in range(self.rows):
+                ids.extend(self.ids[r * self.cols:(r + 1) * self.cols])
+                ids.extend(pad)
+            self.ids = ids
+            self.cols = cols
+        if rows > self.rows:
+            self.ids.extend([0] * ((rows - self.rows) * self.cols))
+            self.rows = rows
+
+    """
+    write-through, cells is an iterable of (col, row, value) as sent
+    with value_input_option, the cells whose rendered value is unknown
+    are marked stale, None values are left unchanged
+    """
+    def write(self, cells, value_input_option='RAW'):
+        if self.expired():
+            return
+        known = []
+        unknown = []
+        for col, row, value in cells:
+            if value is None:
+                # null values are skipped by the API
+                continue
+            v = rendered_value(value, value_input_option)
+            if v is None:
+                unknown.append((col, row))
+            else:
+                known.append((col - self.start_col, row - self.start_row, v))
+        # emptied cells outside of the grid are left out
+        known = [(c, r, v) for c, r, v in known if v or (c < self.cols and r < self.rows)]
+        if known:
+            self._grow(max(c for c, r, v in known) + 1, max(r for c, r, v in known) + 1)
+            for c, r, v in known:
+                self._set(r * self.cols + c, self._id(v))
+        for rect in cells_to_rectangles(unknown):
+            self.invalidate(*rect)
+
+    """
+    empty the cells of the range (start index 1, inclusive)
+    """
+    def clear_range(self, start_col, start_row, end_col, end_row):
+        if self.expired():
+            return
+        c0 = max(start_col - self.start_col, 0)
+        c1 = min(end_col - self.start_col, self.cols - 1)
+        for r in range(max(start_row - self.start_row, 0), min(end_row - self.start_row, self.rows - 1) + 1):
+            for c in range(c0, c1 + 1):
+                self._set(r * self.cols + c, 0)
+
+    """
+    the cells (col, row, value) written with value_input_option that would change
+    the cached values, the cells whose rendered value can't be known are changed
+    """
+    def changed(self, cells, value_input_option='RAW'):
+        result = []
+        for col, row, value in cells:
+            if value is None:
+                continue
+            v = rendered_value(value, value_input_option)
+            if v is None or v != self.value(col, row) or (self.stale and not self.covers(col, row, col, row)):
+                result.append((col, row, value))
+        return result
+
+    """
+    mark a range as not known, it must be fetched again before use
+    """
+    def invalidate(self, start_col, start_row, end_col, end_row):
+        if not self.expired():
+            self.stale.append((start_col, start_row, end_col, end_row))
+
+    """
+    the fetched values of a stale range
+    """
+    def refresh(self, rect, data):
+        start_col, start_row, end_col, end_row = rect
+        self.clear_range(*rect)
+        self.write(((start_col + c, start_row + r, v)
+                    for r, row in enumerate(data) for c, v in enumerate(row)))
+        self.stale = [s for s in self.stale if s != rect]
+
+    """
+    delete rows from start to end (inclusive), following rows are shifted up
+    """
+    def delete_rows(self, start_index, end_index=None):
+        if self.expired():
+            return
+        if self.stale:
+            self.close()
+            return
+        end_index = start_index if end_index is None else end_index
+        r0 = max(start_index - self.start_row, 0)
+        r1 = min(end_index - self.start_row, self.rows - 1)
+        if r0 > r1:
+            return
+        del self.ids[r0 * self.cols:(r1 + 1) * self.cols]
+        self.rows -= r1 - r0 + 1
+        self.index = None
+        self.ragged = True
+
+    """
+    delete columns from start to end (inclusive), following columns are shifted left
+    """
+    def delete_cols(self, start_index, end_index=None):
+        if self.expired():
+            return
+        if self.stale:
+            self.close()
+            return
+        end_index = start_index if end_index is None else end_index
+        c0 = max(start_index - self.start_col, 0)
+        c1 = min(end_index - self.start_col, self.cols - 1)
+        if c0 > c1:
+            return
+        ids = array('I')
+        for r in range(self.rows):
+            ids.extend(self.ids[r * self.cols:r * self.cols + c0])
+            ids.extend(self.ids[r * self.cols + c1 + 1:(r + 1) * self.cols])
+        self.ids = ids
+        self.cols -= c1 - c0 + 1
+        self.index = None
+        self.ragged = True
+
+    """
+    drop the trailing empty rows and columns left by the writes,
+    the grid keep the shape of a fresh fetch (as the lookups see it)
+    """
+    def shrink(self):
+        if not self.ragged or self.stale:
+            return
+        self.ragged = False
+        ids = self.ids
+        cols = self.cols
+        rows = self.rows
+        while rows and not any(ids[(rows - 1) * cols:rows * cols]):
+            rows -= 1
+        del ids[rows * cols:]
+        self.rows = rows
+        width = cols
+        while width and not any(ids[width - 1::cols]):
+            width -= 1
+        if width < cols:
+            self.ids = array('I')
+            for r in range(rows):
+                self.ids.extend(ids[r * cols:r * cols + width])
+            self.cols = width
+            self.index = None
+
+    """
+    the worksheet was resized to cols, rows, drop the cells outside
+    """
+    def resize(self, cols=None, rows=None):
+        if self.expired():
+            return
+        if rows is not None and rows - self.start_row + 1 < self.rows:
+            self.delete_rows(rows + 1, self.start_row + self.rows - 1)
+        if cols is not None and cols - self.start_col + 1 < self.cols:
+            self.delete_cols(cols + 1, self.start_col + self.cols - 1)
+
+    """
+    True if the cached values of the range (start index 1, inclusive) are known,
+    the cache hold the whole worksheet so only the stale ranges are not covered
+    """
+    def covers(self, start_col, start_row, end_col, end_row):
+        if self.expired():
+            return False
+        for c0, r0, c1, r1 in self.stale:
+            if c0 <= end_col and start_col <= c1 and r0 <= end_row and start_row <= r1:
+                return False
+        return True
+
+    """
+    values of the range as returned by the API (trailing empty rows and columns
+    trimmed, rows padded to the same length), the range is clipped to the cached grid
+    """
+    def slice(self, start_col, start_row, end_col, end_row):
+        table = self.table
+        result = []
+        width = 0
+        c0 = max(start_col - self.start_col, 0)
+        c1 = min(end_col - self.start_col, self.cols - 1)
+        for r in range(max(start_row - self.start_row, 0), min(end_row - self.start_row, self.rows - 1) + 1):
+            row = [table[i] for i in self.ids[r * self.cols + c0:r * self.cols + c1 + 1]]
+            while row and row[-1] == '':
+                row.pop()
+            width = max(width, len(row))
+            result.append(row)
+        while result and not result[-1]:
+            result.pop()
+        return [row + [''] * (width - len(row)) for row in result]
+
+    """
+    O(1) value at (col, row), '' outside of the cached grid
+    """
+    def value(self, col, row):
+        c = col - self.start_col
+        r = row - self.start_row
+        if 0 <= c < self.cols and 0 <= r < self.rows:
+            return self.table[self.ids[r * self.cols + c]]
+        return ''
+
+    def cell(self, col, row):
+        return CachedCell(row=row, col=col, value=self.value(col, row))
+
+    """
+    values of the cached row (start index 1)
+    """
+    def row_values(self, row):
+        r = row - self.start_row
+        if not 0 <= r < self.rows:
+            return []
+        table = self.table
+        return [table[i] for i in self.ids[r * self.cols:(r + 1) * self.cols]]
+
+    """
+    iterate all the cached cells row-major
+    """
+    def cells(self):
+        table = self.table
+        cols = self.cols
+        for n, i in enumerate(self.ids):
+            r, c = divmod(n, cols)
+            yield CachedCell(row=r + self.start_row, col=c + self.start_col, value=table[i])
+
+    """
+    the cells a row-major scan would have collected for the matching cells
+    at the sorted flat offsets (see match_offsets)
+    """
+    def match_cells(self, offsets, search_direction='col'):
+        ids = self.ids
+        cols = self.cols
+        table = self.table
+        return [CachedCell(row=self.start_row + n // cols, col=self.start_col + n % cols, value=table[ids[n]])
+                for n in match_offsets(ids, cols, offsets, search_direction)]
+
+    """
+    approximate memory used by the cache in bytes
+    """
+    def footprint(self):
+        table_bytes = sys.getsizeof(self.table) + sum(sys.getsizeof(v) for v in self.table)
+        index_bytes = sys.getsizeof(self.table_index)
+        ids_bytes = sys.getsizeof(self.ids)
+        if self.index is not None:
+            index_bytes += sum(sys.getsizeof(a) for a in self.index.positions.values())
+            index_bytes += sum(sys.getsizeof(i) for i in self.index.tokens.values())
+            index_bytes += sum(sys.getsizeof(i) for i in self.index.folded.values())
+            index_bytes += sys.getsizeof(self.index.positions) + sys.getsizeof(self.index.tokens)
+            index_bytes += sys.getsizeof(self.index.folded)
+        return {
+            'cells': len(self.ids),
+            'distinct_values': len(self.table),
+            'ids_bytes': ids_bytes,
+            'table_bytes': table_bytes,
+            'index_bytes': index_bytes,
+            'bytes': ids_bytes + table_bytes + index_bytes,
+        }
+
+class CacheStore(object):
+    """
+    per worksheet DataCache keyed by (spreadsheet id, worksheet id)
+    the least recently used caches are evicted once the total footprint
+    go over max_bytes (the most recent one is always kept)
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+
+    def __repr__(self):
+        return "<{} entries:{} max_bytes:{}>".format(
+            self.__class__.__name__,
+            len(self.entries),
+            self.max_bytes)
+
+    def get(self, key):
+        cache = self.entries.get(key)
+        if cache is None:
+            cache = self.entries[key] = DataCache()
+        self.entries.move_to_end(key)
+        return cache
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    """
+    discard all the worksheets caches of a spreadsheet
+    """
+    def discard_spreadsheet(self, spreadsheet_id):
+        for key in [k for k in self.entries if k[0] == spreadsheet_id]:
+            del self.entries[key]
+
+    def close(self):
+        self.entries.clear()
+
+    """
+    the spreadsheet was modified by us, its version changed for all its worksheets
+    """
+    def unstamp(self, spreadsheet_id):
+        for key, cache in self.entries.items():
+            if key[0] == spreadsheet_id:
+                cache.version = None
+
+    """
+    the valid caches of the spreadsheet
+    """
+    def valid(self, spreadsheet_id):
+        return [cache for key, cache in self.entries.items() if key[0] == spreadsheet_id and not cache.expired()]
+
+    """
+    the spreadsheet was modified by us, its valid caches are at version
+    """
+    def stamp(self, spreadsheet_id, version):
+        for cache in self.valid(spreadsheet_id):
+            cache.version = version
+            cache.checked_at = time.monotonic()
+
+    def footprint(self):
+        return sum(c.footprint()['bytes'] for c in self.entries.values())
+
+    """
+    evict the least recently used caches until the footprint fit in max_bytes
+    """
+    def trim(self):
+        if not self.max_bytes:
+            return
+        sizes = OrderedDict((k, c.footprint()['bytes']) for k, c in self.entries.items())
+        total = sum(sizes.values())
+        for key, size in list(sizes.items())[:-1]:
+            if total <= self.max_bytes:
+                break
+            logger.info ("cache evict {} {} bytes".format(key, size))
+            del self.entries[key]
+            total -= size
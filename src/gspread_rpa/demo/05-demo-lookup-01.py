@@ -142,8 +142,7 @@ if __name__ == "__main__":
     logger.info ("lookup: {}".format(e))
     match_location = gs.lookup_match (match=e, search_direction='x')
     logger.info (match_location)
-    for m in match_location:
-        r = gs.get_values (m)
+    for m, r in zip(match_location, gs.get_values_many (match_location)):
         logger.info ("result: {} {}".format (m, r))
         assert trim(r) == [], "unexpected result {}".format(r)
 
@@ -154,8 +153,7 @@ if __name__ == "__main__":
     logger.info ("lookup: {}".format(e))
     match_location = gs.lookup_match (match=e, search_direction='y')
     logger.info (match_location)
-    for m in match_location:
-        r = gs.get_values (m)
+    for m, r in zip(match_location, gs.get_values_many (match_location)):
         logger.info ("result: {} {}".format (m, [i[0] for i in r]))
         assert trim([i[0] for i in r]) == [], "unexpected result {}".format(trim([i[0] for i in r]))
 
@@ -0,0 +1,148 @@
+"""
+NumPy view of a cached worksheet
+
+a GridView is a snapshot of the values cache of the active worksheet: the
+cells value ids as a 2-D numpy array (rows x cols) and the distinct values
+as a 1-D array. a predicate is evaluated once per distinct value and spread
+over the cells by indexing, the masks returned are numpy boolean arrays,
+2-D (rows x cols) or 1-D (one entry per row) when restricted to a column,
+and may be combined with & | ~
+
+usage:
+    view = gs.grid_view()
+    mask = view.equals('Diana', col=1) & view.empty(col=3)
+    view.rows(mask)                   # row numbers (start index 1)
+    view.spans(mask, col=1)           # GridIndex runs of the column 1 cells of those rows
+    view.cells(view.regex(r"^Pat"))   # CellIndex list
+    view.lookup(view.contains('van'), search_direction='x')  # as lookup_match
+
+numpy is only required to build a GridView.
+"""
+
+import re
+import logging
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from . import CellIndex
+from .data_cache import fold, match_offsets
+
+logger = logging.getLogger('GridView')
+
+class GridView(object):
+
+    """
+    gs: the GoogleSheets used for the spans (match_spans)
+    cache: DataCache of the worksheet, copied
+    """
+    def __init__(self, gs, cache):
+        if numpy is None:
+            raise ImportError ("GridView require numpy (pip install gspread-rpa[numpy])")
+        self.gs = gs
+        self.start_col = cache.start_col
+        self.start_row = cache.start_row
+        self.ids = numpy.array(cache.ids, dtype=numpy.uint32).reshape(cache.rows, cache.cols)
+        self.table = numpy.array(cache.table, dtype=object)
+        self._folded = None
+
+    def __repr__(self):
+        return "<{} rows:{} cols:{} distinct_values:{}>".format(
+            self.__class__.__name__,
+            self.ids.shape[0],
+            self.ids.shape[1],
+            len(self.table))
+
+    def folded(self):
+        if self._folded is None:
+            self._folded = numpy.array([fold(v) for v in self.table], dtype=object)
+        return self._folded
+
+    """
+    spread a mask over the distinct values to the cells, of column col only if given
+    """
+    def _cells(self, table_mask, col=None):
+        if col is None:
+            return table_mask[self.ids]
+        c = col - self.start_col
+        if 0 <= c < self.ids.shape[1]:
+            return table_mask[self.ids[:, c]]
+        return numpy.full(self.ids.shape[0], table_mask[0], dtype=bool)
+
+    """
+    cells whose value is value (case insensitive if casefold)
+    """
+    def equals(self, value, col=None, casefold=False):
+        value = '' if value is None else str(value)
+        if casefold:
+            return self._cells(self.folded() == fold(value), col)
+        return self._cells(self.table == value, col)
+
+    """
+    cells whose value hold text (case insensitive if casefold)
+    """
+    def contains(self, text, col=None, casefold=True):
+        text = fold(text) if casefold else text
+        table = self.folded() if casefold else self.table
+        # one substring test per distinct value, a numpy.char copy would be as wide as the longest value
+        return self._cells(numpy.fromiter((text in v for v in table), dtype=bool, count=len(table)), col)
+
+    """
+    empty cells
+    """
+    def empty(self, col=None):
+        if col is None:
+            return self.ids == 0
+        return self._cells(numpy.arange(len(self.table)) == 0, col)
+
+    """
+    cells whose value is matched by pattern (re.search)
+    """
+    def regex(self, pattern, col=None, flags=re.IGNORECASE):
+        search = re.compile(pattern, flags).search
+        matcher = numpy.vectorize(lambda v: search(v) is not None, otypes=[bool])
+        return self._cells(matcher(self.table), col)
+
+    """
+    cells whose value satisfy predicate(value)
+    """
+    def where(self, predicate, col=None):
+        matcher = numpy.vectorize(lambda v: bool(predicate(v)), otypes=[bool])
+        return self._cells(matcher(self.table), col)
+
+    """
+    row numbers (start index 1) of a row mask (1-D)
+    """
+    def rows(self, mask):
+        assert mask.ndim == 1, "row mask expected"
+        return [self.start_row + int(r) for r in numpy.flatnonzero(mask)]
+
+    """
+    CellIndex of the cells of a cell mask (2-D), of the column col for a row mask (1-D)
+    """
+    def cells(self, mask, col=None):
+        if mask.ndim == 1:
+            assert col is not None, "col is required with a row mask"
+            return [CellIndex(col=col, row=r) for r in self.rows(mask)]
+        rows, cols = numpy.nonzero(mask)
+        return [CellIndex(col=self.start_col + int(c), row=self.start_row + int(r)) for r, c in zip(rows, cols)]
+
+    """
+    GridIndex runs of adjacent cells of the mask, sorted by length in search_direction
+    (see GoogleSheets.match_spans), vertical runs of the column col for a row mask
+    """
+    def spans(self, mask, search_direction='col', col=None):
+        if mask.ndim == 1:
+            search_direction = 'row'
+        return self.gs.match_spans(self.cells(mask, col=col), search_direction)
+
+    """
+    lookup_match of a cell mask: the matching cells extended by the following empty cells
+    in search_direction, grouped into GridIndex runs
+    """
+    def lookup(self, mask, search_direction='col'):
+        cols = self.ids.shape[1]
+        offsets = numpy.flatnonzero(mask).tolist()
+        found = match_offsets(self.ids.ravel(), cols, offsets, search_direction)
+        cells = [CellIndex(col=self.start_col + n % cols, row=self.start_row + n // cols) for n in found]
+        return self.gs.match_spans(cells, search_direction)
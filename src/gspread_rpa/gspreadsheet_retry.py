@@ -8,6 +8,7 @@ from collections import namedtuple
 # from gspread_formatting import functions
 import json
 from .retry import retry
+from .quota import quota_limiter, quota_family
 
 logger = logging.getLogger('gspreadsheet_retry')
 
@@ -22,12 +23,24 @@ require a fully qualified exception class name
 """
 error_quota_req = RetryException(name='gspread.exceptions.APIError', code=429)
 error_quota_qps = RetryException(name='gspread.exceptions.APIError', code=403)
+"""
+transient server/gateway errors (may come with an HTML body)
+"""
+error_transient = [RetryException(name='gspread.exceptions.APIError', code=c) for c in (500, 502, 503, 504)]
 
 class ClientRetry(Client):
 
     def __init__(self, auth, session=None):
         super(type(self), self).__init__(auth=auth, session=session)
 
+    """
+    every request (including the one sent by SpreadsheetRetry and WorksheetRetry)
+    draw a token from the shared quota limiter before being sent
+    """
+    def request(self, method, endpoint, *args, **kwargs):
+        quota_limiter.acquire(quota_family(method, endpoint))
+        return super(type(self), self).request(method, endpoint, *args, **kwargs)
+
     # @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps])
     # def open(self, title, folder_id=None):
     #     return super(type(self), self).open(title=title, folder_id=folder_id)
@@ -44,12 +57,13 @@ class ClientRetry(Client):
     # def openall(self, title=None):
     #     return super(type(self), self).openall(title=title)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps, error_quota_req])
+    # not retried on transient errors, the change may have been applied already
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps, error_quota_req], circuit='drive_files')
     def create(self, title, folder_id=None):
         logger.info ("Client create: {}".format(self))
         return super(type(self), self).create(title=title, folder_id=folder_id)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps, *error_transient], circuit='drive_revisions')
     def revision_list (self, spreadsheet_id):
         # [
         #     {'kind': 'drive#revision', 'id': '1', 'mimeType': 'application/vnd.google-apps.spreadsheet',
@@ -88,7 +102,7 @@ class ClientRetry(Client):
     """
     return last revision or sprecified revision_id if found
     """
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps, *error_transient], circuit='drive_revisions')
     def revision_last(self, spreadsheet_id, revision_id=None):
         rev = self.revision_list (spreadsheet_id)
         rev = [SimpleNamespace(**n) for n in rev]
@@ -110,7 +124,7 @@ class ClientRetry(Client):
                    mime_type='application/x-vnd.oasis.opendocument.spreadsheet')
 
     """
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps, *error_transient], circuit='drive_revisions')
     def file_export(self, fd, spreadsheet_id, revision_id='head',
                     mime_type='application/x-vnd.oasis.opendocument.spreadsheet'):
         revision = self.revision_last(spreadsheet_id, revision_id)
@@ -138,7 +152,8 @@ class ClientRetry(Client):
       'mimeType': 'application/vnd.google-apps.spreadsheet'
     }
     """
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps])
+    # not retried on transient errors, the change may have been applied already
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps], circuit='drive_files')
     def file_upload(self, fd, title='', mime_type='application/x-vnd.oasis.opendocument.spreadsheet'):
         headers = None
         params = {
@@ -173,7 +188,7 @@ class ClientRetry(Client):
     """
     delete previously uploaded user file. return True on success
     """
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps, *error_transient], circuit='drive_files')
     def file_delete (self, id):
         params = {}
         j = {}
@@ -181,25 +196,37 @@ class ClientRetry(Client):
         res = self.request("delete", "{}/{}".format(DRIVE_FILES_API_V3_URL, id))
         return res.status_code in (200, 204)
 
+    """
+    metadata only Drive files.get, by default the fields used to validate a cache:
+    {'modifiedTime': '2021-12-13T11:42:10.496Z', 'version': '40'}
+    """
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_qps, *error_transient], circuit='drive_files')
+    def file_metadata (self, file_id, fields='modifiedTime,version'):
+        params = {'fields': fields, 'supportsAllDrives': True}
+        res = self.request("get", "{}/{}".format(DRIVE_FILES_API_V3_URL, file_id), params=params)
+        return res.json()
+
 class SpreadsheetRetry(Spreadsheet):
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def __init__(foo, self):
         super().__init__(self.client, properties=self._properties)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def worksheets(self):
         return super(type(self), self).worksheets()
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    # not retried on transient errors, the change may have been applied already
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req], circuit='sheets_batch_update')
     def batch_update(self, body):
         return super(type(self), self).batch_update(body=body)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def fetch_sheet_metadata(self, params=None):
         return super(type(self), self).fetch_sheet_metadata(params=params)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    # not retried on transient errors, the change may have been applied already
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req], circuit='sheets_batch_update')
     def _spreadsheets_sheets_copy_to(self, sheet_id, destination_spreadsheet_id):
         return super(type(self), self)._spreadsheets_sheets_copy_to(sheet_id, destination_spreadsheet_id)
 
@@ -218,56 +245,104 @@ class SpreadsheetRetry(Spreadsheet):
 
 class WorksheetRetry(Worksheet):
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def __init__(foo, self):
         super().__init__(spreadsheet=self.spreadsheet, properties=self._properties)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_batch_update')
     def resize(self, **kwargs):
         """resize worksheet to cols, rows count."""
         return super(type(self), self).resize(**kwargs)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def get_values(self, range_name=None, **kwargs):
         """Returns a list of lists containing all cells' values as strings."""
         return super(type(self), self).get_values(range_name, **kwargs)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def get_all_values(self, **kwargs):
         """Returns a list of lists containing all cells' values as strings."""
         return super(type(self), self).get_all_values(**kwargs)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def findall(self, query, in_row=None, in_column=None):
         """Finds all cells matching the query."""
         return super(type(self), self).findall(query=query, in_row=in_row, in_column=in_column)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def col_values(self, col, value_render_option=utils.ValueRenderOption.formatted):
         return super(type(self), self).col_values(col, value_render_option=value_render_option)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def row_values(self, row, value_render_option=utils.ValueRenderOption.formatted):
         return super(type(self), self).row_values(row, value_render_option=value_render_option)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    # not retried on transient errors, the change may have been applied already
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req], circuit='sheets_batch_update')
     def delete_rows(self, start_index, end_index=None):
         return super(type(self), self).delete_rows(start_index, end_index=end_index)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def update_cell(self, row, col, value):
         return super(type(self), self).update_cell(row=row, col=col, value=value)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def update_cells(self, cell_list, value_input_option=utils.ValueInputOption.raw):
         return super(type(self), self).update_cells(cell_list=cell_list,
                                                     value_input_option=value_input_option)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
+    def values_batch_get(self, ranges, major_dimension=None, value_render_option=None, date_time_render_option=None):
+        """Returns the values of several ranges (A1 notation), padded as get_values, with a single values.batchGet request."""
+        params = utils.filter_dict_values({
+            'majorDimension': major_dimension,
+            'valueRenderOption': value_render_option,
+            'dateTimeRenderOption': date_time_render_option,
+        })
+        response = self.spreadsheet.values_batch_get(
+            [utils.absolute_range_name(self.title, range_name) for range_name in ranges], params=params)
+        return [utils.fill_gaps(value_range.get('values', [])) for value_range in response.get('valueRanges', [])]
+
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
+    def values_update(self, range_name, values, value_input_option=utils.ValueInputOption.raw, **params):
+        """Sets the values (list of rows) of range_name (A1 notation) with a single values.update request."""
+        params['valueInputOption'] = value_input_option
+        return self.spreadsheet.values_update(utils.absolute_range_name(self.title, range_name),
+                                              params=params,
+                                              body={'values': values, 'majorDimension': 'ROWS'})
+
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
+    def values_batch_update(self, data, value_input_option=utils.ValueInputOption.raw, **params):
+        """Sets the values of several ranges, data a list of (A1 range, values), with a single values.batchUpdate request.
+        params are the values.update ones (includeValuesInResponse...), sent in the request body."""
+        body = dict(params)
+        body.update({
+            'valueInputOption': value_input_option,
+            'data': [{'range': utils.absolute_range_name(self.title, range_name),
+                      'values': values,
+                      'majorDimension': 'ROWS'} for range_name, values in data],
+        })
+        return self.spreadsheet.values_batch_update(body=body)
+
+    # not retried on transient errors, the rows may have been appended already
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req], circuit='sheets_values')
+    def values_append(self, range_name, values, value_input_option=utils.ValueInputOption.raw,
+                      insert_data_option='INSERT_ROWS', **params):
+        """Appends the values (list of rows) after the table found at range_name with a single values.append request."""
+        params['valueInputOption'] = value_input_option
+        params['insertDataOption'] = insert_data_option
+        result = self.spreadsheet.values_append(utils.absolute_range_name(self.title, range_name),
+                                                params=params,
+                                                body={'values': values, 'majorDimension': 'ROWS'})
+        if insert_data_option == 'INSERT_ROWS':
+            self._properties['gridProperties']['rowCount'] += len(values)
+        return result
+
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def batch_clear(self, ranges):
         return super(type(self), self).batch_clear(ranges=ranges)
 
-    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req])
+    @retry(tries=15, delay=2, backoff=2, except_retry=[error_quota_req, *error_transient], circuit='sheets_values')
     def range(self, name):
         return super(type(self), self).range(name=name)
 
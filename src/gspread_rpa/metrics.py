@@ -0,0 +1,96 @@
+"""
+retry/backoff instrumentation
+
+every retried call (retry and async_retry) report its events keyed by the
+qualified name of the wrapped function, e.g. 'WorksheetRetry.get_values'.
+
+    attempt  a call is sent
+    retry    a retryable error occured and the call will be sent again after sleep seconds
+    failure  the call gave up (non retryable error, attempts or deadline exhausted, circuit open)
+
+snapshot:
+    from gspread_rpa import metrics_snapshot
+    for name, m in metrics_snapshot().items():
+        print (name, m['attempts'], m['retries'], m['sleep_seconds'], m['error_codes'])
+
+hook (e.g. to feed prometheus/statsd), called for every event:
+    def hook(event, name, fields):
+        ...
+    add_metrics_hook(hook)
+"""
+
+import copy
+import threading
+import logging
+
+logger = logging.getLogger('metrics')
+
+class RetryMetrics(object):
+
+    SLEEP_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, float('inf'))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.hooks = []
+
+    def _new(self):
+        return {
+            'attempts': 0,
+            'retries': 0,
+            'failures': 0,
+            'sleep_seconds': 0.0,
+            'sleep_histogram': dict((b, 0) for b in self.SLEEP_BUCKETS),
+            'error_codes': {},
+        }
+
+    """
+    event: 'attempt', 'retry' or 'failure'
+    fields: code (error code or exception name) and sleep (seconds) for 'retry'
+    """
+    def record(self, event, name, **fields):
+        with self.lock:
+            m = self.data.get(name)
+            if m is None:
+                m = self.data[name] = self._new()
+            if event == 'attempt':
+                m['attempts'] += 1
+            elif event == 'retry':
+                m['retries'] += 1
+                sleep = fields.get('sleep', 0)
+                m['sleep_seconds'] += sleep
+                m['sleep_histogram'][next(b for b in self.SLEEP_BUCKETS if sleep <= b)] += 1
+            elif event == 'failure':
+                m['failures'] += 1
+            if fields.get('code') is not None:
+                m['error_codes'][fields['code']] = m['error_codes'].get(fields['code'], 0) + 1
+            hooks = list(self.hooks)
+        for hook in hooks:
+            try:
+                hook(event, name, fields)
+            except Exception as e:
+                logger.error ("metrics hook {}: {}".format(hook, e))
+
+    def snapshot(self):
+        with self.lock:
+            return copy.deepcopy(self.data)
+
+    def reset(self):
+        with self.lock:
+            self.data = {}
+
+"""
+process wide metrics used by retry
+"""
+retry_metrics = RetryMetrics()
+
+def metrics_snapshot():
+    return retry_metrics.snapshot()
+
+def add_metrics_hook(hook):
+    with retry_metrics.lock:
+        retry_metrics.hooks.append(hook)
+
+def remove_metrics_hook(hook):
+    with retry_metrics.lock:
+        retry_metrics.hooks.remove(hook)
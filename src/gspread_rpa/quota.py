@@ -0,0 +1,160 @@
+"""
+proactive quota limiter
+
+Google Sheets quotas are counted per minute (read and write requests),
+instead of waiting for a 429 and backing off, every request sent by a
+ClientRetry draw a token from the bucket of its quota family first and
+block until a token is available.
+
+the limiter is shared by every GoogleSheets instance of the process,
+the buckets may be configured with:
+
+    from gspread_rpa import configure_quota
+    configure_quota(read_per_minute=300, write_per_minute=300)
+
+a per_minute of 0 (or None) disable the bucket.
+
+worker processes of a host sharing the same service account may share the
+buckets through a lock protected state file, either with
+configure_quota(..., shared_path='/var/tmp/gspread_rpa.quota') or by setting
+the GOOGLESHEETS_QUOTA_FILE environment variable. (POSIX only)
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('quota')
+
+SHEETS_API_HOST = 'sheets.googleapis.com'
+
+class TokenBucket(object):
+    def __init__(self, per_minute, burst=None):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        # by default allow a burst of 10 seconds worth of requests
+        self.capacity = float(burst if burst else max(1.0, self.rate * 10))
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{} per_minute:{} capacity:{}>".format(
+            self.__class__.__name__,
+            self.per_minute,
+            self.capacity)
+
+    """
+    refill tokens since stamp, take n of them if available, return the new tokens
+    and 0 on success otherwise the delay in seconds to wait before the tokens are available
+    """
+    def _take(self, tokens, stamp, now, n):
+        tokens = min(self.capacity, tokens + max(0.0, now - stamp) * self.rate)
+        if tokens >= n:
+            return tokens - n, 0
+        return tokens, (n - tokens) / self.rate
+
+    def take(self, n=1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens, wait = self._take(self.tokens, self.stamp, now, n)
+            self.stamp = now
+            return wait
+
+class FileTokenBucket(TokenBucket):
+    """
+    token bucket whose state is kept in a flock protected json file
+    shared by all the processes of the host using the same path
+    """
+    def __init__(self, path, family, per_minute, burst=None):
+        if fcntl is None:
+            raise NotImplementedError ("shared quota file require fcntl (POSIX)")
+        super(FileTokenBucket, self).__init__(per_minute, burst=burst)
+        self.path = path
+        self.family = family
+
+    def __repr__(self):
+        return "<{} path:{} family:{} per_minute:{} capacity:{}>".format(
+            self.__class__.__name__,
+            self.path,
+            self.family,
+            self.per_minute,
+            self.capacity)
+
+    def take(self, n=1):
+        with self.lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                now = time.time() # shared between processes, can't be monotonic
+                try:
+                    state = json.loads(os.read(fd, 65536) or b'{}')
+                except ValueError:
+                    logger.warning ("quota file {} corrupted, reset".format(self.path))
+                    state = {}
+                tokens, stamp = state.get(self.family, [self.capacity, now])
+                tokens, wait = self._take(tokens, stamp, now, n)
+                state[self.family] = [tokens, now]
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, json.dumps(state).encode())
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            return wait
+
+class QuotaLimiter(object):
+    def __init__(self, read_per_minute=60, write_per_minute=60, burst=None, shared_path=None):
+        self.buckets = {}
+        self.configure(read_per_minute=read_per_minute, write_per_minute=write_per_minute,
+                       burst=burst, shared_path=shared_path)
+
+    def configure(self, read_per_minute=None, write_per_minute=None, burst=None, shared_path=None):
+        for family, per_minute in [('read', read_per_minute), ('write', write_per_minute)]:
+            if per_minute and shared_path:
+                self.buckets[family] = FileTokenBucket(shared_path, family, per_minute, burst=burst)
+            elif per_minute:
+                self.buckets[family] = TokenBucket(per_minute, burst=burst)
+            else:
+                self.buckets.pop(family, None)
+        logger.debug ("quota buckets: {}".format(self.buckets))
+
+    """
+    block until a token of the quota family is available,
+    return the number of seconds spent waiting
+    """
+    def acquire(self, family, n=1):
+        bucket = self.buckets.get(family)
+        waited = 0
+        while bucket is not None:
+            wait = bucket.take(n)
+            if not wait:
+                break
+            logger.debug ("quota {} wait {:.3f}".format(family, wait))
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+"""
+return the quota family ('read' or 'write') of a request,
+None if the endpoint is not counted against the Sheets quota
+"""
+def quota_family(method, endpoint):
+    if SHEETS_API_HOST not in endpoint:
+        return None
+    return 'read' if method.lower() == 'get' else 'write'
+
+"""
+process wide limiter used by ClientRetry
+"""
+quota_limiter = QuotaLimiter(shared_path=os.getenv('GOOGLESHEETS_QUOTA_FILE') or None)
+
+def configure_quota(read_per_minute=60, write_per_minute=60, burst=None, shared_path=None):
+    quota_limiter.configure(read_per_minute=read_per_minute, write_per_minute=write_per_minute,
+                            burst=burst, shared_path=shared_path or os.getenv('GOOGLESHEETS_QUOTA_FILE') or None)
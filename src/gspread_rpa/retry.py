@@ -12,15 +12,176 @@ https://wiki.python.org/moin/PythonDecoratorLibrary#Retry
 
 import time
 import math
+import random
 import logging
+import threading
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import SimpleNamespace
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from .circuit import circuit_breaker, CircuitOpenError
+from .metrics import retry_metrics
 
 logger = logging.getLogger('retry')
 
 class RetryError(Exception):
     pass
 
+"""
+per thread retry context, the outermost retried frame own the attempt budget,
+nested retried frames (e.g. GoogleSheets.open -> GoogleSheets.worksheets ->
+SpreadsheetRetry.worksheets) consume the same budget instead of multiplying it
+"""
+_context = threading.local()
+
+"""
+the circuit families checked by the retried frames running in the current thread
+"""
+def _circuits():
+    circuits = getattr(_context, 'circuits', None)
+    if circuits is None:
+        circuits = _context.circuits = set()
+    return circuits
+
+"""
+restrict every retried call of the current thread to a single attempt,
+used when the retry is driven by an outer loop (e.g. async_retry)
+"""
+@contextmanager
+def single_attempt():
+    budget = getattr(_context, 'budget', None)
+    _context.budget = SimpleNamespace(tries=1, start=time.monotonic(), deadline=None)
+    try:
+        yield
+    finally:
+        _context.budget = budget
+
+"""
+the attempt budget of the current thread, None outside of a retried call,
+to be shared with the worker threads the call spreads its requests on
+"""
+def current_budget():
+    return getattr(_context, 'budget', None)
+
+"""
+run the retried calls of a worker thread on the budget of the thread that
+started it (current_budget), e.g. a single attempt under AsyncGoogleSheets
+"""
+@contextmanager
+def shared_budget(budget):
+    previous = getattr(_context, 'budget', None)
+    _context.budget = budget
+    try:
+        yield
+    finally:
+        _context.budget = previous
+
+"""
+fully qualified class name, computed once per exception class
+"""
+@lru_cache(maxsize=None)
+def error_name(cls):
+    return "{}.{}".format(cls.__module__ ,  cls.__name__)
+
+"""
+return the HTTP status of the exception response if any, otherwise
+the 'code' of the API json error, None if there is none
+"""
+def error_code(e):
+    response = getattr(e, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if isinstance(status, int):
+        return status
+    for i in e.args:
+        # the payload could be HTML rather than json
+        # <title>Error 502 (Server Error)!!1</title>
+        if isinstance(i, dict) and 'code' in i:
+            try:
+                return int(i['code'])
+            except (TypeError, ValueError):
+                return None
+    return None
+
+"""
+report the outcome of a failed attempt to the circuit breaker, return True if
+reported: an outage (5xx, connection error, timeout) is a failure, any other
+HTTP answer (a 429 rate limit included) shows the endpoint is up, an error
+raised without an answer (e.g. a local ValueError) is not reported
+"""
+def report_failure(breaker, e):
+    if isinstance(e, (ConnectionError, TimeoutError,
+                      requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        breaker.failure()
+        return True
+    code = error_code(e)
+    if code is None:
+        return False
+    if code >= 500:
+        breaker.failure()
+    else:
+        breaker.success()
+    return True
+
+"""
+build once at decoration time the classifier of except_retry,
+a list of (fully qualified exception name, code) pairs,
+classify(e) return (retryable, err_name, err_code).
+except_retry None retry the errors the retried call raising them found
+retryable (flagged e.retryable by retry), e.g. when the retry of calls run
+with single_attempt is driven by an outer loop
+"""
+def retry_classifier(except_retry):
+    codes = {}
+    for err_name, err_code in except_retry or []:
+        codes.setdefault(err_name, set()).add(err_code)
+
+    def classify(e):
+        err_name = error_name(e.__class__)
+        err_code = error_code(e)
+        logger.debug ("exception handling {} {}".format(err_name, err_code))
+        if except_retry is None:
+            return getattr(e, 'retryable', False) is True, err_name, err_code
+        return err_code in codes.get(err_name, ()), err_name, err_code
+    return classify
+
+"""
+return the delay in seconds requested by the server through the Retry-After
+header of the exception response (seconds or HTTP date) or None
+"""
+def retry_after(e):
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None)
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+"""
+full jitter wait for the current delay, at least the server Retry-After if any
+"""
+def backoff_sleep(e, mdelay):
+    sleep = random.uniform(0, mdelay)
+    hint = retry_after(e)
+    if hint is not None:
+        sleep = max(sleep, hint)
+    return sleep
+
 # Retry decorator with exponential backoff
-def retry(tries, delay=3, backoff=2, except_retry=[]):
+def retry(tries, delay=3, backoff=2, except_retry=[], max_delay=64, deadline=None, circuit=None):
     """
     Retries a function or method until it returns True.
 
@@ -28,57 +189,212 @@ def retry(tries, delay=3, backoff=2, except_retry=[]):
     the delay should lengthen after each failure. backoff must be greater than 1,
     or else it isn't really a backoff. tries must be at least 0, and delay
     greater than 0.
+
+    the actual wait is a random value between 0 and the current delay (full jitter)
+    so that parallel workers don't retry in lockstep, the current delay is capped
+    to max_delay. a Retry-After sent by the server is honored.
+    deadline if set is the total wall-clock budget in seconds, once the next wait
+    would go past it the previous exception is raised.
+
+    nested retried calls share the attempt budget and deadline of the outermost
+    retried call of the thread, so tries is the total number of attempts. a call
+    started once the budget is used up is still attempted once, without retry.
+
+    circuit if set is the name of the endpoint family circuit breaker, outages
+    (5xx, connection errors, timeouts) are reported to it as failures, the other
+    HTTP answers as successes, and CircuitOpenError is raised without sending
+    the call while the circuit is open. the nested retried calls of the same
+    family are checked and reported once, by the outermost of them.
     """
 
     assert backoff > 1, "backoff must be greater than 1"
     tries = math.floor(tries)
     assert tries >= 0, "tries must be 0 or greater"
     assert delay > 0, "delay must be greater than 0"
+    assert max_delay >= delay, "max_delay must be greater than delay"
+    assert deadline is None or deadline > 0, "deadline must be greater than 0"
+
+    classify = retry_classifier(except_retry)
 
     def deco_retry(f):
+        name = f.__qualname__
         def f_retry(*args, **kwargs):
-            mtries, mdelay = tries, delay # make mutable
-            while mtries > 0:
-                try:
-                    result = f(*args, **kwargs)
-                except Exception as e:
-                    err_name = "{}.{}".format(e.__class__.__module__ ,  e.__class__.__name__)
-                    err_code = None
+            budget = getattr(_context, 'budget', None)
+            outermost = budget is None
+            if outermost:
+                budget = SimpleNamespace(tries=tries, start=time.monotonic(), deadline=deadline)
+                _context.budget = budget
+            # the nested frames of a family are covered by the breaker of its outermost frame
+            circuits = _circuits()
+            breaker = circuit_breaker(circuit) if circuit and circuit not in circuits else None
+            if breaker:
+                circuits.add(circuit)
+            mdelay = delay # make mutable
+            start = time.monotonic()
+            try:
+                # a nested call finding the budget used up still make one attempt
+                while True:
+                    trial = False
+                    if breaker:
+                        try:
+                            trial = breaker.check()
+                        except CircuitOpenError:
+                            retry_metrics.record('failure', name, code='circuit_open')
+                            raise
+                    reported = False
+                    retry_metrics.record('attempt', name)
                     try:
-                        err_code = [i['code'] for i in e.args if 'code' in i]
-                        err_code = int(err_code[0]) if err_code else None
-                        logger.debug ("exception handling {} {}".format(err_name, err_code))
-                    except TypeError:
-                        # response could be HTML rather than json
-                        # <title>Error 502 (Server Error)!!1</title>
-                        pass
-                    if (err_name, err_code) in except_retry:
-                        pass
-                    else:
-                        logger.debug ("retry.py l58: {}".format(f))
-                        logger.debug ("retry.py l59: {}".format(err_name))
-                        logger.debug ("retry.py l60: {}".format(err_code))
-                        logger.debug ("retry.py l61: {}".format(e))
-                        raise e
-
-                    mtries -= 1      # consume an attempt
-                    # logger.warning("retry {} mtries: {}".format(f, mtries))
-                    if mtries > 0:
-                        logger.warning("retry {} mtries: {} mdelay: {}".format(f, mtries, mdelay))
-                        time.sleep(mdelay) # wait...
-                        mdelay *= backoff  # make future wait longer
-                        # Try again
-                    else:
-                        if e:
-                            logger.warning ("retry.py 67: {}".format(e))
-                            logger.warning ("retry.py 68: {}".format(e.args))
+                        result = f(*args, **kwargs)
+                    except CircuitOpenError:
+                        # raised by a nested retried call, the endpoint didn't answer
+                        raise
+                    except Exception as e:
+                        retryable, err_name, err_code = classify(e)
+                        if breaker:
+                            reported = report_failure(breaker, e)
+                        if not retryable:
+                            retry_metrics.record('failure', name, code=err_code or err_name)
+                            logger.debug ("retry.py l58: {}".format(f))
+                            logger.debug ("retry.py l59: {}".format(err_name))
+                            logger.debug ("retry.py l60: {}".format(err_code))
+                            logger.debug ("retry.py l61: {}".format(e))
                             raise e
-                        raise RetryError
-                else:
-                    return result
+
+                        budget.tries -= 1      # consume an attempt
+                        sleep = backoff_sleep(e, mdelay)
+                        now = time.monotonic()
+                        if (deadline is not None and now - start + sleep > deadline) or (
+                                budget.deadline is not None and now - budget.start + sleep > budget.deadline):
+                            logger.warning ("retry {} deadline reached".format(f))
+                            budget.tries = 0
+                        if budget.tries > 0:
+                            retry_metrics.record('retry', name, code=err_code or err_name, sleep=sleep)
+                            logger.warning("retry {} mtries: {} sleep: {:.2f}".format(f, budget.tries, sleep))
+                            time.sleep(sleep) # wait...
+                            mdelay = min(mdelay * backoff, max_delay)  # make future wait longer
+                            # Try again
+                        else:
+                            retry_metrics.record('failure', name, code=err_code or err_name)
+                            if e:
+                                # out of attempts on a retryable error
+                                e.retryable = True
+                                logger.warning ("retry.py 67: {}".format(e))
+                                logger.warning ("retry.py 68: {}".format(e.args))
+                                raise e
+                            raise RetryError
+                    else:
+                        if breaker: breaker.success()
+                        reported = True
+                        return result
+                    finally:
+                        # a trial that didn't reach the endpoint must not hold the circuit half-open
+                        if trial and not reported:
+                            breaker.release()
+            finally:
+                if breaker:
+                    circuits.discard(circuit)
+                if outermost:
+                    _context.budget = None
         return f_retry # true decorator -> decorated function
     return deco_retry  # @retry(arg[, ...]) -> true decorator
 
+"""
+per task budget of async_retry, shared by nested async retried coroutines
+"""
+_async_budget = ContextVar('async_retry_budget', default=None)
+
+"""
+the circuit families checked by the async retried frames of the current task
+"""
+_async_circuits = ContextVar('async_retry_circuits', default=frozenset())
+
+# asyncio retry decorator, same as retry but waiting with asyncio.sleep
+def async_retry(tries, delay=3, backoff=2, except_retry=[], max_delay=64, deadline=None, circuit=None):
+    """
+    Retries a coroutine function, see retry for the arguments.
+
+    the event loop is never blocked while waiting, the budget is shared by
+    the nested async retried coroutines of the same task.
+    """
+
+    assert backoff > 1, "backoff must be greater than 1"
+    tries = math.floor(tries)
+    assert tries >= 0, "tries must be 0 or greater"
+    assert delay > 0, "delay must be greater than 0"
+    assert max_delay >= delay, "max_delay must be greater than delay"
+    assert deadline is None or deadline > 0, "deadline must be greater than 0"
+
+    classify = retry_classifier(except_retry)
+
+    def deco_retry(f):
+        name = f.__qualname__
+        async def f_retry(*args, **kwargs):
+            budget = _async_budget.get()
+            token = None
+            if budget is None:
+                budget = SimpleNamespace(tries=tries, start=time.monotonic(), deadline=deadline)
+                token = _async_budget.set(budget)
+            circuits = _async_circuits.get()
+            breaker = circuit_breaker(circuit) if circuit and circuit not in circuits else None
+            circuits_token = _async_circuits.set(circuits | {circuit}) if breaker else None
+            mdelay = delay # make mutable
+            start = time.monotonic()
+            try:
+                # a nested call finding the budget used up still make one attempt
+                while True:
+                    trial = False
+                    if breaker:
+                        try:
+                            trial = breaker.check()
+                        except CircuitOpenError:
+                            retry_metrics.record('failure', name, code='circuit_open')
+                            raise
+                    reported = False
+                    retry_metrics.record('attempt', name)
+                    try:
+                        result = await f(*args, **kwargs)
+                    except CircuitOpenError:
+                        # raised by a nested retried call, the endpoint didn't answer
+                        raise
+                    except Exception as e:
+                        retryable, err_name, err_code = classify(e)
+                        if breaker:
+                            reported = report_failure(breaker, e)
+                        if not retryable:
+                            retry_metrics.record('failure', name, code=err_code or err_name)
+                            raise e
+
+                        budget.tries -= 1      # consume an attempt
+                        sleep = backoff_sleep(e, mdelay)
+                        now = time.monotonic()
+                        if (deadline is not None and now - start + sleep > deadline) or (
+                                budget.deadline is not None and now - budget.start + sleep > budget.deadline):
+                            logger.warning ("async retry {} deadline reached".format(f))
+                            budget.tries = 0
+                        if budget.tries > 0:
+                            retry_metrics.record('retry', name, code=err_code or err_name, sleep=sleep)
+                            logger.warning("async retry {} mtries: {} sleep: {:.2f}".format(f, budget.tries, sleep))
+                            await asyncio.sleep(sleep) # wait...
+                            mdelay = min(mdelay * backoff, max_delay)  # make future wait longer
+                        else:
+                            retry_metrics.record('failure', name, code=err_code or err_name)
+                            raise e
+                    else:
+                        if breaker: breaker.success()
+                        reported = True
+                        return result
+                    finally:
+                        # cancelled or CircuitOpenError, the trial didn't reach the endpoint
+                        if trial and not reported:
+                            breaker.release()
+            finally:
+                if circuits_token is not None:
+                    _async_circuits.reset(circuits_token)
+                if token is not None:
+                    _async_budget.reset(token)
+        return f_retry
+    return deco_retry
+
 if __name__ == "__main__":
 
     @retry (tries=3, delay=1, backoff=2, except_retry=[('builtins.ZeroDivisionError', None)])
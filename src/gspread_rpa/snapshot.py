@@ -0,0 +1,143 @@
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger('SnapshotStore')
+
+class SnapshotError(Exception):
+    pass
+
+"""
+persistent worksheet values snapshots
+
+a SQLite file keyed by (spreadsheet id, worksheet id, Drive version), the
+values are stored as zlib compressed json lines (one line per row) and read
+back as a stream of rows, a process started on a spreadsheet version already
+seen doesn't need to fetch the grid again.
+
+the snapshots are an optional cache, a database error (locked by another
+process, corrupt file) is logged and the values are fetched from the network.
+
+usage:
+    gs = GoogleSheets(snapshot_path='/var/cache/gspread_rpa.sqlite')
+"""
+
+class SnapshotStore(object):
+
+    CHUNK_SIZE = 64 * 1024
+
+    """
+    path: SQLite file, created if needed
+    max_versions: number of versions kept per worksheet
+    """
+    def __init__(self, path, max_versions=2):
+        self.path = path
+        self.max_versions = max_versions
+        self.lock = threading.RLock()
+        self._db = None
+
+    def __repr__(self):
+        return "<{} path:{}>".format(self.__class__.__name__, self.path)
+
+    """
+    the database is only opened on first use
+    """
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS snapshot ("
+                " spreadsheet_id TEXT, worksheet_id INTEGER, version TEXT,"
+                " created REAL, rows INTEGER, cols INTEGER, data BLOB,"
+                " PRIMARY KEY (spreadsheet_id, worksheet_id, version))")
+            self._db.commit()
+        return self._db
+
+    def close(self):
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def save(self, spreadsheet_id, worksheet_id, version, data):
+        if version is None:
+            return
+        compress = zlib.compressobj()
+        blob = b''.join(compress.compress((json.dumps(row) + '\n').encode()) for row in data)
+        blob += compress.flush()
+        cols = max(map(len, data)) if data else 0
+        with self.lock:
+            try:
+                db = self.db()
+                db.execute("INSERT OR REPLACE INTO snapshot VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (spreadsheet_id, worksheet_id, str(version), time.time(), len(data), cols, blob))
+                db.execute("DELETE FROM snapshot WHERE spreadsheet_id = ? AND worksheet_id = ? AND version NOT IN ("
+                           " SELECT version FROM snapshot WHERE spreadsheet_id = ? AND worksheet_id = ?"
+                           " ORDER BY created DESC LIMIT ?)",
+                           (spreadsheet_id, worksheet_id, spreadsheet_id, worksheet_id, self.max_versions))
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning ("save {} {} {}: {}".format(spreadsheet_id, worksheet_id, version, e))
+                self._rollback()
+                return
+        logger.debug ("save {} {} {} {} bytes".format(spreadsheet_id, worksheet_id, version, len(blob)))
+
+    def _rollback(self):
+        try:
+            if self._db is not None:
+                self._db.rollback()
+        except sqlite3.Error:
+            pass
+
+    """
+    return (rows, cols, iterator of rows) or None if there is no snapshot of this version
+    (or the database can't be read), the iterator raise SnapshotError on a read error
+    """
+    def load(self, spreadsheet_id, worksheet_id, version):
+        if version is None:
+            return None
+        with self.lock:
+            try:
+                row = self.db().execute(
+                    "SELECT rowid, rows, cols FROM snapshot"
+                    " WHERE spreadsheet_id = ? AND worksheet_id = ? AND version = ?",
+                    (spreadsheet_id, worksheet_id, str(version))).fetchone()
+            except sqlite3.Error as e:
+                logger.warning ("load {} {} {}: {}".format(spreadsheet_id, worksheet_id, version, e))
+                return None
+        if row is None:
+            return None
+        rowid, rows, cols = row
+        return rows, cols, self._rows(rowid)
+
+    def _chunks(self, rowid):
+        with self.lock:
+            db = self.db()
+            if not hasattr(db, 'blobopen'):
+                # python < 3.11, no incremental blob I/O
+                yield db.execute("SELECT data FROM snapshot WHERE rowid = ?", (rowid,)).fetchone()[0]
+                return
+            with db.blobopen('snapshot', 'data', rowid, readonly=True) as blob:
+                chunk = blob.read(self.CHUNK_SIZE)
+                while chunk:
+                    yield chunk
+                    chunk = blob.read(self.CHUNK_SIZE)
+
+    def _rows(self, rowid):
+        decompress = zlib.decompressobj()
+        pending = b''
+        try:
+            for chunk in self._chunks(rowid):
+                pending += decompress.decompress(chunk)
+                lines = pending.split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    yield json.loads(line)
+            pending += decompress.flush()
+            if pending:
+                yield json.loads(pending)
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            raise SnapshotError ("snapshot {}: {}".format(rowid, e)) from e
@@ -0,0 +1,148 @@
+"""
+buffered write session
+
+GoogleSheets.batch() queue the values written (update_cell, update_cells) and
+the ranges cleared (clear) of every worksheet instead of sending them, the
+last write of a cell wins and a clear drop the pending writes it covers.
+on flush, per worksheet, the clears are sent first as one values.batchClear
+then the writes as one values.batchUpdate per value input option, the cells
+merged into as few rectangles as possible.
+"""
+
+import json
+import logging
+from types import SimpleNamespace
+from gspread.utils import rowcol_to_a1, a1_to_rowcol
+from .data_cache import cells_to_rectangles
+
+logger = logging.getLogger('WriteBatch')
+
+def a1_range(start_col, start_row, end_col, end_row):
+    return "{}:{}".format(rowcol_to_a1(col=start_col, row=start_row), rowcol_to_a1(col=end_col, row=end_row))
+
+"""
+(start_col, start_row, end_col, end_row) of an A1 range like 'Sheet1'!A11:C12
+"""
+def range_rect(range_name):
+    cells = range_name.rsplit('!', 1)[-1].split(':')
+    (start_row, start_col), (end_row, end_col) = a1_to_rowcol(cells[0]), a1_to_rowcol(cells[-1])
+    return start_col, start_row, end_col, end_row
+
+"""
+split the matrix values into consecutive row blocks (row offset, rows), each one
+holding at most max_cells cells and max_bytes bytes of json (0 or None: no limit),
+a single row larger than the budget is a block on its own
+"""
+def row_blocks(values, max_bytes=None, max_cells=None):
+    start, block, size, cells = 0, [], 0, 0
+    for i, row in enumerate(values):
+        row_size = len(json.dumps(row, default=str)) + 1
+        if block and ((max_bytes and size + row_size > max_bytes) or (max_cells and cells + len(row) > max_cells)):
+            yield start, block
+            start, block, size, cells = i, [], 0, 0
+        block.append(row)
+        size += row_size
+        cells += len(row)
+    if block:
+        yield start, block
+
+"""
+group the consecutive (range, values, ...) items of data into requests holding at
+most max_cells cells and max_bytes bytes of json (0 or None: no limit)
+"""
+def range_groups(data, max_bytes=None, max_cells=None):
+    group, size, cells = [], 0, 0
+    for item in data:
+        item_size = len(json.dumps(item[1], default=str))
+        item_cells = sum(map(len, item[1]))
+        if group and ((max_bytes and size + item_size > max_bytes) or (max_cells and cells + item_cells > max_cells)):
+            yield group
+            group, size, cells = [], 0, 0
+        group.append(item)
+        size += item_size
+        cells += item_cells
+    if group:
+        yield group
+
+class WriteBatch(object):
+
+    """
+    max_cells: the owner flush once more than max_cells cells are pending
+    """
+    def __init__(self, max_cells=10000):
+        self.max_cells = max_cells
+        # (spreadsheet id, worksheet id) -> worksheet, cells {(col, row): (value, value_input_option)}, clears
+        self.pending = {}
+
+    def __repr__(self):
+        return "<{} worksheets:{} cells:{} max_cells:{}>".format(
+            self.__class__.__name__,
+            len(self.pending),
+            self.size(),
+            self.max_cells)
+
+    def _pending(self, worksheet):
+        key = (worksheet.spreadsheet.id, worksheet.id)
+        if key not in self.pending:
+            self.pending[key] = SimpleNamespace(worksheet=worksheet, cells={}, clears=[])
+        return self.pending[key]
+
+    """
+    drop the pending writes of a spreadsheet (deleted)
+    """
+    def discard(self, spreadsheet_id):
+        for key in [k for k in self.pending if k[0] == spreadsheet_id]:
+            del self.pending[key]
+
+    def keys(self):
+        return list(self.pending)
+
+    def size(self):
+        return sum(len(p.cells) + len(p.clears) for p in self.pending.values())
+
+    def full(self):
+        return bool(self.max_cells) and self.size() > self.max_cells
+
+    """
+    queue cells, an iterable of (col, row, value), None values are left unchanged
+    """
+    def write(self, worksheet, cells, value_input_option):
+        pending = self._pending(worksheet).cells
+        for col, row, value in cells:
+            if value is not None:
+                pending[(col, row)] = (value, value_input_option)
+
+    """
+    queue the clear of rect_list, a list of (start_col, start_row, end_col, end_row)
+    """
+    def clear(self, worksheet, rect_list):
+        pending = self._pending(worksheet)
+        for c0, r0, c1, r1 in rect_list:
+            for col, row in [k for k in pending.cells if c0 <= k[0] <= c1 and r0 <= k[1] <= r1]:
+                del pending.cells[(col, row)]
+            if (c0, r0, c1, r1) not in pending.clears:
+                pending.clears.append((c0, r0, c1, r1))
+
+    """
+    send the pending clears and writes, return the number of cells updated.
+    the queue is emptied even on failure
+    """
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        updated = 0
+        for key, p in pending.items():
+            if p.clears:
+                logger.debug ("flush {} clear {}".format(key, len(p.clears)))
+                p.worksheet.batch_clear([a1_range(*rect) for rect in p.clears])
+            options = {}
+            for (col, row), (value, value_input_option) in p.cells.items():
+                options.setdefault(value_input_option, {})[(col, row)] = value
+            for value_input_option, cells in options.items():
+                data = []
+                for c0, r0, c1, r1 in cells_to_rectangles(cells):
+                    values = [[cells[(col, row)] for col in range(c0, c1 + 1)] for row in range(r0, r1 + 1)]
+                    data.append((a1_range(c0, r0, c1, r1), values))
+                logger.debug ("flush {} {} cells in {} ranges".format(key, len(cells), len(data)))
+                result = p.worksheet.values_batch_update(data, value_input_option=value_input_option)
+                updated += result.get('totalUpdatedCells', 0) if result else 0
+        return updated
@@ -0,0 +1,85 @@
+import sys
+import asyncio
+import pytest
+from gspread_rpa.retry import retry, async_retry, error_name
+from gspread_rpa.async_sheets import AsyncGoogleSheets
+
+retry_module = sys.modules['gspread_rpa.retry']
+
+
+class Throttled(Exception):
+    pass
+
+
+class Forbidden(Exception):
+    pass
+
+
+THROTTLED = [(error_name(Throttled), None)]
+
+
+@pytest.fixture(autouse=True)
+def no_wait(monkeypatch):
+    monkeypatch.setattr(retry_module, 'backoff_sleep', lambda e, mdelay: 0)
+
+
+class Sheets(object):
+    """ stand-in for GoogleSheets, failing the first calls of each method """
+
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = []
+
+    def fail(self, name):
+        self.calls.append(name)
+        if self.failures:
+            raise self.failures.pop(0)
+
+    @retry(tries=15, delay=0.001, except_retry=THROTTLED)
+    def get_values(self, grid_index=None):
+        self.fail('get_values')
+        return [['a']]
+
+    @retry(tries=3, delay=0.001, except_retry=THROTTLED)
+    def append_rows(self, rows):
+        self.fail('append_rows')
+        return len(rows)
+
+
+def test_each_attempt_is_single_and_retried_from_the_loop():
+    gs = Sheets([Throttled(), Throttled()])
+    assert asyncio.run(AsyncGoogleSheets(gs=gs).get_values()) == [['a']]
+    assert gs.calls == ['get_values'] * 3
+
+
+def test_error_not_retried_by_the_call_is_not_retried_from_the_loop():
+    gs = Sheets([Forbidden()])
+    with pytest.raises(Forbidden):
+        asyncio.run(AsyncGoogleSheets(gs=gs).get_values())
+    assert gs.calls == ['get_values']
+
+
+def test_append_rows_is_not_run_again_from_the_loop():
+    gs = Sheets([Throttled()] * 10)
+    with pytest.raises(Throttled):
+        asyncio.run(AsyncGoogleSheets(gs=gs).append_rows([[1], [2]]))
+    # the 3 attempts of the retried call only
+    assert gs.calls == ['append_rows'] * 3
+
+
+def test_async_retry_budget_shared_by_nested_coroutines():
+    calls = []
+
+    @async_retry(tries=4, delay=0.001, except_retry=THROTTLED)
+    async def inner():
+        calls.append(1)
+        raise Throttled()
+
+    @async_retry(tries=4, delay=0.001, except_retry=THROTTLED)
+    async def outer():
+        await inner()
+
+    with pytest.raises(Throttled):
+        asyncio.run(outer())
+    assert len(calls) == 4
+
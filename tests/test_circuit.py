@@ -0,0 +1,191 @@
+import time
+import asyncio
+import pytest
+from types import SimpleNamespace
+from gspread_rpa.retry import retry, async_retry, error_name
+from gspread_rpa.circuit import CircuitBreaker, CircuitOpenError, circuit_breaker, configure_circuit
+
+
+class Unavailable(Exception):
+
+    def __init__(self):
+        super().__init__({'code': 503})
+        self.response = SimpleNamespace(status_code=503, headers={})
+
+
+UNAVAILABLE = [(error_name(Unavailable), 503)]
+
+
+def open_circuit(name, reset_timeout=0.01):
+    configure_circuit(name, failure_threshold=1, reset_timeout=reset_timeout)
+    breaker = circuit_breaker(name)
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker('opens', failure_threshold=2, reset_timeout=60)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_half_open_single_trial():
+    breaker = CircuitBreaker('trial', failure_threshold=1, reset_timeout=0.01)
+    breaker.failure()
+    assert not breaker.allow()
+    time.sleep(0.02)
+    assert breaker.check() is True
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.check() is False
+
+
+def test_released_trial_is_given_again():
+    breaker = CircuitBreaker('release', failure_threshold=1, reset_timeout=0.01)
+    breaker.failure()
+    time.sleep(0.02)
+    assert breaker.check() is True
+    breaker.release()
+    assert breaker.check() is True
+
+
+def test_lost_trial_expires():
+    breaker = CircuitBreaker('expire', failure_threshold=1, reset_timeout=0.01)
+    breaker.failure()
+    time.sleep(0.02)
+    assert breaker.check() is True
+    assert not breaker.allow()
+    time.sleep(0.02)
+    assert breaker.check() is True
+
+
+def test_open_circuit_fails_fast():
+    open_circuit('fast', reset_timeout=60)
+    calls = []
+
+    @retry(tries=5, delay=0.001, except_retry=UNAVAILABLE, circuit='fast')
+    def call():
+        calls.append(1)
+
+    with pytest.raises(CircuitOpenError):
+        call()
+    assert calls == []
+
+
+def test_nested_same_family_recovers():
+    # like revision_last calling revision_list, both in 'drive_revisions'
+    breaker = open_circuit('nested_same')
+
+    @retry(tries=5, delay=0.001, except_retry=UNAVAILABLE, circuit='nested_same')
+    def revision_list():
+        return ['1', '2']
+
+    @retry(tries=5, delay=0.001, except_retry=UNAVAILABLE, circuit='nested_same')
+    def revision_last():
+        return revision_list()[-1]
+
+    time.sleep(0.02)
+    assert revision_last() == '2'
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert revision_list() == ['1', '2']
+
+
+def test_nested_open_circuit_gives_back_the_trial():
+    outer_breaker = open_circuit('nested_outer')
+    inner_breaker = open_circuit('nested_inner', reset_timeout=60)
+
+    @retry(tries=5, delay=0.001, except_retry=UNAVAILABLE, circuit='nested_inner')
+    def inner():
+        return 'inner'
+
+    @retry(tries=5, delay=0.001, except_retry=UNAVAILABLE, circuit='nested_outer')
+    def outer():
+        return inner()
+
+    time.sleep(0.02)
+    with pytest.raises(CircuitOpenError):
+        outer()
+    # the outer endpoint wasn't reached: still half-open, the next call is the trial
+    assert outer_breaker.state == CircuitBreaker.HALF_OPEN
+    assert inner_breaker.state == CircuitBreaker.OPEN
+    inner_breaker.success()
+    assert outer() == 'inner'
+    assert outer_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_async_trial_is_given_back():
+    breaker = open_circuit('cancelled')
+
+    @async_retry(tries=5, delay=0.001, except_retry=UNAVAILABLE, circuit='cancelled')
+    async def call(wait):
+        await asyncio.sleep(wait)
+        return 'ok'
+
+    async def run():
+        task = asyncio.ensure_future(call(10))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await call(0)
+
+    time.sleep(0.02)
+    assert asyncio.run(run()) == 'ok'
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+class Throttled(Exception):
+
+    def __init__(self):
+        super().__init__({'code': 429})
+        self.response = SimpleNamespace(status_code=429, headers={})
+
+
+def test_rate_limit_does_not_open_the_circuit():
+    configure_circuit('throttled', failure_threshold=2, reset_timeout=60)
+    calls = []
+
+    @retry(tries=6, delay=0.001, except_retry=[(error_name(Throttled), 429)], circuit='throttled')
+    def call():
+        calls.append(1)
+        raise Throttled()
+
+    with pytest.raises(Throttled):
+        call()
+    assert len(calls) == 6
+    assert circuit_breaker('throttled').state == CircuitBreaker.CLOSED
+
+
+def test_outage_opens_the_circuit():
+    configure_circuit('outage', failure_threshold=2, reset_timeout=60)
+    calls = []
+
+    @retry(tries=6, delay=0.001, except_retry=UNAVAILABLE, circuit='outage')
+    def call():
+        calls.append(1)
+        raise Unavailable()
+
+    with pytest.raises(CircuitOpenError):
+        call()
+    assert len(calls) == 2
+
+
+def test_local_error_does_not_close_a_half_open_circuit():
+    breaker = open_circuit('local')
+
+    @retry(tries=5, delay=0.001, except_retry=UNAVAILABLE, circuit='local')
+    def call(value):
+        return int(value)
+
+    time.sleep(0.02)
+    with pytest.raises(ValueError):
+        call('x')
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert call('1') == 1
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,198 @@
+from gspread_rpa.data_cache import DataCache, ExactMatch, rendered_value, match_offsets, merge_dirty, fold
+
+
+def make_cache(data, **kwargs):
+    cache = DataCache()
+    cache.store(data, **kwargs)
+    return cache
+
+
+def test_new_cache_is_expired():
+    cache = DataCache()
+    assert cache.expired()
+    assert cache.value(1, 1) == ''
+    assert list(cache.cells()) == []
+
+
+def test_store_pads_short_rows():
+    cache = make_cache([['a', 'b', 'c'], ['d']])
+    assert not cache.expired()
+    assert (cache.cols, cache.rows) == (3, 2)
+    assert cache.row_values(2) == ['d', '', '']
+    assert cache.value(3, 2) == ''
+
+
+def test_store_with_offset():
+    cache = make_cache([['a', 'b']], start_col=3, start_row=5)
+    assert cache.value(3, 5) == 'a'
+    assert cache.value(4, 5) == 'b'
+    assert cache.value(1, 1) == ''
+    assert cache.row_values(5) == ['a', 'b']
+    assert cache.row_values(1) == []
+
+
+def test_store_streamed_rows():
+    cache = make_cache(iter([['a'], ['b', 'c']]), cols=2)
+    assert cache.row_values(1) == ['a', '']
+    assert cache.row_values(2) == ['b', 'c']
+
+
+def test_distinct_values_stored_once():
+    cache = make_cache([['yes', 'no'] * 50 for _ in range(100)])
+    footprint = cache.footprint()
+    assert footprint['cells'] == 10000
+    # '' plus the two values
+    assert footprint['distinct_values'] == 3
+    assert cache.value(1, 100) == 'yes'
+    assert cache.value(100, 1) == 'no'
+
+
+def test_cells_row_major():
+    cache = make_cache([['a', 'b'], ['c', 'd']], start_row=2)
+    cells = [(c.col, c.row, c.value) for c in cache.cells()]
+    assert cells == [(1, 2, 'a'), (2, 2, 'b'), (1, 3, 'c'), (2, 3, 'd')]
+    assert cache.cell(2, 3).value == 'd'
+
+
+def test_store_replaces_previous_grid():
+    cache = make_cache([['a', 'b'], ['c', 'd']])
+    cache.store([['x']])
+    assert (cache.cols, cache.rows) == (1, 1)
+    assert cache.value(2, 2) == ''
+    cache.close()
+    assert cache.expired()
+
+
+def test_write_through_grows_the_grid():
+    cache = make_cache([['a', 'b'], ['c', 'd']])
+    cache.write([(4, 3, 'x'), (1, 1, None)])
+    assert (cache.cols, cache.rows) == (4, 3)
+    assert cache.value(4, 3) == 'x'
+    assert cache.value(1, 1) == 'a'
+    cache.write([(4, 3, '')])
+    cache.shrink()
+    assert (cache.cols, cache.rows) == (2, 2)
+    assert not cache.stale
+
+
+def test_write_through_numbers():
+    cache = make_cache([['a', 'b']])
+    cache.write([(1, 1, 42), (2, 1, 1.5), (3, 1, 2.0), (4, 1, True)])
+    assert cache.row_values(1) == ['42', '1.5', '2', 'TRUE']
+    assert not cache.stale
+    cache.write([(1, 1, 1 / 3), (2, 1, 1e20)], 'USER_ENTERED')
+    assert cache.stale == [(1, 1, 2, 1)]
+
+
+def test_write_through_parsed_strings_are_stale():
+    cache = make_cache([['a', 'b', 'c']])
+    cache.write([(1, 1, '=A2'), (2, 1, 'Room 5B'), (3, 1, '-x')], 'USER_ENTERED')
+    assert cache.value(2, 1) == 'Room 5B'
+    assert cache.stale == [(1, 1, 1, 1), (3, 1, 3, 1)]
+    assert not cache.covers(1, 1, 3, 1)
+    assert cache.covers(2, 1, 2, 1)
+
+
+def test_rendered_value():
+    assert rendered_value(None) == ''
+    assert rendered_value(False) == 'FALSE'
+    assert rendered_value(-7) == '-7'
+    assert rendered_value(0.25, 'USER_ENTERED') == '0.25'
+    assert rendered_value(0.1 + 0.2) is None
+    assert rendered_value(10 ** 15) is None
+    assert rendered_value(float('nan')) is None
+    assert rendered_value('=A1', 'RAW') == '=A1'
+    assert rendered_value('-5', 'RAW') == '-5'
+    assert rendered_value("'007", 'USER_ENTERED') == '007'
+    for parsed in ('5', '$5.00', '50%', '1,234.5', '2024-01-02', '1/2', '12:30', 'Jan 5',
+                   '=A1', 'true', '+x', '-abc', '- item'):
+        assert rendered_value(parsed, 'USER_ENTERED') is None, parsed
+    for text in ('Room 5B', 'SKU-123', 'Order #42', 'abc'):
+        assert rendered_value(text, 'USER_ENTERED') == text
+
+
+def test_clear_range():
+    cache = make_cache([['a', 'b'], ['c', 'd']])
+    cache.clear_range(2, 1, 5, 5)
+    assert cache.row_values(1) == ['a', '']
+    assert cache.row_values(2) == ['c', '']
+
+
+def test_value_index_follows_writes():
+    cache = make_cache([['a', 'b'], ['a', 'c']])
+    index = cache.value_index()
+    assert index.find_exact(['a']) == [0, 2]
+    cache.write([(1, 1, 'c'), (2, 2, 'a')])
+    assert index.find_exact(['a']) == [2, 3]
+    assert index.find_exact(['c']) == [0]
+    cache.write([(1, 1, 'a')])
+    assert index.find_exact(['a']) == [0, 2, 3]
+
+
+def test_value_index_overwrite_of_many_cells():
+    n = 20000
+    cache = make_cache([['same'] for _ in range(n)])
+    index = cache.value_index()
+    cache.write((1, r, 'other') for r in range(n, 0, -1))
+    assert index.find_exact(['same']) == []
+    assert index.find_exact(['other']) == list(range(n))
+
+
+def test_match_offsets_extend_to_the_empty_cells():
+    # a b .
+    # . . c
+    ids = [1, 2, 0, 0, 0, 3]
+    assert match_offsets(ids, 3, [1], 'col') == [1, 2]
+    assert match_offsets(ids, 3, [0], 'row') == [0, 3]
+
+
+def test_match_offsets_down_a_single_column():
+    ids = [1, 0, 0, 2]
+    assert match_offsets(ids, 1, [0], 'row') == [0, 1, 2]
+    assert match_offsets(ids, 1, [0], 'col') == [0]
+
+
+def test_find_exact_modes():
+    cache = make_cache([['İstanbul', 'STRASSE'], ['istanbul', '']])
+    index = cache.value_index()
+    assert index.find_exact(['istanbul']) == [2]
+    assert index.find_exact([fold('istanbul')], 'casefold') == [0, 2]
+    assert ExactMatch(['straße'], 'casefold').search('STRASSE')
+    assert not ExactMatch(['strasse'], 'exact').search('STRASSE')
+
+
+def test_changed_cells():
+    cache = make_cache([['a', '42', '1.5', '$3.00']])
+    cells = [(1, 1, 'a'), (2, 1, 42), (3, 1, 1.5), (4, 1, 3), (5, 1, None), (5, 1, 7), (1, 1, '=A2')]
+    # the formatted '$3.00' and the formula can't be compared
+    assert cache.changed(cells, 'USER_ENTERED') == [(4, 1, 3), (5, 1, 7), (1, 1, '=A2')]
+    assert cache.changed([(2, 1, 42.0), (3, 1, 2.5)], 'RAW') == [(3, 1, 2.5)]
+
+
+def test_changed_stale_cells():
+    cache = make_cache([['a', 'b']])
+    cache.invalidate(2, 1, 2, 1)
+    assert cache.changed([(1, 1, 'a'), (2, 1, 'b')]) == [(2, 1, 'b')]
+
+
+def test_merge_dirty_sends_cheap_clean_gaps():
+    dirty = {(1, 1): 'a', (3, 1): 'c', (1, 2): 'x', (9, 2): 'y'}
+    clean = {(2, 1): 'b'}
+    clean.update(((col, 2), 'z') for col in range(2, 9))
+    rects, cells = merge_dirty(dirty, clean, range_cost=10)
+    assert cells[(2, 1)] == 'b'
+    assert (2, 2) not in cells
+    assert sorted(rects) == [(1, 1, 3, 1), (1, 2, 1, 2), (9, 2, 9, 2)]
+
+
+def test_merge_dirty_numbers():
+    dirty = {(1, 1): 1, (3, 1): 3}
+    rects, cells = merge_dirty(dirty, {(2, 1): 2})
+    assert rects == [(1, 1, 3, 1)]
+    assert cells == {(1, 1): 1, (2, 1): 2, (3, 1): 3}
+
+
+def test_merge_dirty_keeps_unknown_gaps():
+    rects, cells = merge_dirty({(1, 1): 'a', (3, 1): 'c'}, {})
+    assert sorted(rects) == [(1, 1, 1, 1), (3, 1, 3, 1)]
+    assert cells == {(1, 1): 'a', (3, 1): 'c'}
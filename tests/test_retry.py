@@ -0,0 +1,97 @@
+import sys
+import pytest
+from gspread_rpa.retry import retry, error_name
+
+retry_module = sys.modules['gspread_rpa.retry']
+
+
+class Throttled(Exception):
+    pass
+
+
+THROTTLED = [(error_name(Throttled), None)]
+
+
+def test_nested_calls_share_the_outer_budget():
+    attempts = []
+
+    @retry(tries=4, delay=0.001, except_retry=THROTTLED)
+    def inner():
+        attempts.append('inner')
+        raise Throttled()
+
+    @retry(tries=4, delay=0.001, except_retry=THROTTLED)
+    def outer():
+        attempts.append('outer')
+        inner()
+
+    with pytest.raises(Throttled):
+        outer()
+    # 4 requests in total, not 4 * 4
+    assert attempts == ['outer'] + ['inner'] * 4
+
+
+def test_call_after_the_budget_is_used_up_runs_once():
+    calls = []
+
+    @retry(tries=2, delay=0.001, except_retry=THROTTLED)
+    def exhausted():
+        raise Throttled()
+
+    @retry(tries=2, delay=0.001, except_retry=THROTTLED)
+    def fetch():
+        calls.append(1)
+        return 'value'
+
+    @retry(tries=2, delay=0.001, except_retry=THROTTLED)
+    def outer():
+        try:
+            exhausted()
+        except Throttled:
+            pass
+        return fetch()
+
+    assert outer() == 'value'
+    assert calls == [1]
+
+
+def test_budget_reset_for_the_next_outer_call():
+    failures = [Throttled(), Throttled()]
+
+    @retry(tries=3, delay=0.001, except_retry=THROTTLED)
+    def call():
+        if failures:
+            raise failures.pop()
+        return 'ok'
+
+    assert call() == 'ok'
+    failures.extend([Throttled(), Throttled()])
+    assert call() == 'ok'
+
+
+def test_exhausted_error_is_flagged_retryable():
+    @retry(tries=2, delay=0.001, except_retry=THROTTLED)
+    def call():
+        raise Throttled()
+
+    with pytest.raises(Throttled) as info:
+        call()
+    assert info.value.retryable is True
+
+
+def test_deadline_shared_by_nested_calls(monkeypatch):
+    monkeypatch.setattr(retry_module, 'backoff_sleep', lambda e, mdelay: mdelay)
+    attempts = []
+
+    @retry(tries=50, delay=0.05, max_delay=0.05, except_retry=THROTTLED)
+    def inner():
+        attempts.append(1)
+        raise Throttled()
+
+    @retry(tries=50, delay=0.05, max_delay=0.05, except_retry=THROTTLED, deadline=0.001)
+    def outer():
+        inner()
+
+    with pytest.raises(Throttled):
+        outer()
+    assert len(attempts) == 1
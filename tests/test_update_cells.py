@@ -0,0 +1,97 @@
+import sys
+import pytest
+from types import SimpleNamespace
+from gspread_rpa import GoogleSheets, CellIndex
+from gspread_rpa.retry import retry, single_attempt, error_name
+from gspread_rpa.data_cache import CacheStore
+
+
+class Worksheet(object):
+    """ a worksheet of unformatted values, recording its requests """
+
+    def __init__(self, rows):
+        self.id = 0
+        self.spreadsheet = SimpleNamespace(id='sid')
+        self.rows = [list(row) for row in rows]
+        self.requests = []
+
+    def get_values(self, range_name=None, **kwargs):
+        self.requests.append(('get_values', range_name))
+        return [[str(v) for v in row] for row in self.rows]
+
+    def values_update(self, range_name, values, value_input_option='RAW', **kwargs):
+        self.requests.append(('values_update', range_name, values, kwargs))
+        return {'updatedCells': sum(map(len, values))}
+
+    def values_batch_update(self, data, value_input_option='RAW', **kwargs):
+        self.requests.append(('values_batch_update', [d[0] for d in data], kwargs))
+        return {'totalUpdatedCells': sum(len(row) for _, values in data for row in values)}
+
+
+def open_sheets(rows):
+    gs = GoogleSheets.__new__(GoogleSheets)
+    gs.worksheet_cursor = Worksheet(rows)
+    gs.spreadsheet_cursor = gs.worksheet_cursor.spreadsheet
+    gs.cache_store = CacheStore()
+    gs.cache_check_interval = None
+    gs.snapshot_store = None
+    gs.write_batch = None
+    return gs
+
+
+def test_diff_numbers_unchanged_are_not_sent():
+    gs = open_sheets([[1, 2.5, 3], [4, 5, 6]])
+    assert gs.update_cells(CellIndex(1, 1), [[1, 2.5, 3], [4, 5, 6]], diff=True) is None
+    assert gs.worksheet_cursor.requests == [('get_values', None)]
+
+
+def test_diff_sends_the_changed_numbers_only():
+    gs = open_sheets([[1, 2, 3], [4, 5, 6]])
+    gs.update_cells(CellIndex(1, 1), [[1, 2, 3], [4, 50, 6]], diff=True)
+    assert gs.worksheet_cursor.requests[1:] == [('values_update', 'B2:B2', [[50]], {})]
+    # the written number is cached, the same diff sends nothing
+    assert gs.update_cells(CellIndex(1, 1), [[1, 2, 3], [4, 50, 6]], diff=True) is None
+    assert len(gs.worksheet_cursor.requests) == 2
+
+
+def test_chunks_sent_concurrently_with_the_options():
+    gs = open_sheets([])
+    values = [['v'] * 4 for _ in range(10)]
+    result = gs.update_cells(CellIndex(1, 1), values, max_cells=8, includeValuesInResponse=True)
+    assert result['updatedCells'] == 40
+    requests = gs.worksheet_cursor.requests
+    assert all(r[-1] == {'includeValuesInResponse': True} for r in requests)
+    ranges = sorted(r for request in requests for r in (request[1] if isinstance(request[1], list) else [request[1]]))
+    assert ranges == ['A1:D2', 'A3:D4', 'A5:D6', 'A7:D8', 'A9:D10']
+
+
+def test_options_not_queued_in_a_batch_session():
+    gs = open_sheets([])
+    with pytest.raises(ValueError):
+        with gs.batch():
+            gs.update_cells(CellIndex(1, 1), [['a']], includeValuesInResponse=True)
+    assert gs.worksheet_cursor.requests == []
+
+
+def test_chunk_workers_share_the_caller_budget(monkeypatch):
+    monkeypatch.setattr(sys.modules['gspread_rpa.retry'], 'backoff_sleep', lambda e, mdelay: 0)
+    attempts = []
+
+    class Throttled(Exception):
+        pass
+
+    class Flaky(Worksheet):
+        @retry(tries=15, delay=0.001, except_retry=[(error_name(Throttled), None)])
+        def values_update(self, range_name, values, value_input_option='RAW', **kwargs):
+            attempts.append(range_name)
+            if range_name == 'A3:A4':
+                raise Throttled()
+            return {'updatedCells': sum(map(len, values))}
+
+    gs = open_sheets([])
+    gs.worksheet_cursor = Flaky([])
+    with single_attempt():
+        with pytest.raises(Throttled):
+            gs.update_cells(CellIndex(1, 1), [['v']] * 6, max_cells=2)
+    # the failing chunk was attempted once, its retry is left to the caller
+    assert sorted(attempts) == ['A1:A2', 'A3:A4', 'A5:A6']
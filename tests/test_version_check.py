@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+from gspread_rpa import GoogleSheets
+from gspread_rpa.data_cache import CacheStore
+
+
+class Worksheet(object):
+    """ a worksheet holding one row, recording its requests """
+
+    def __init__(self):
+        self.id = 0
+        self.row = ['a', 'b']
+        self.requests = []
+
+    def get_values(self, range_name=None, **kwargs):
+        self.requests.append('get_values')
+        return [list(self.row)]
+
+    def update_cell(self, row, col, value):
+        self.requests.append('update_cell')
+        self.row[col - 1] = str(value)
+
+
+def open_sheets(cache_check_interval):
+    gs = GoogleSheets.__new__(GoogleSheets)
+    gs.spreadsheet_cursor = SimpleNamespace(id='sid')
+    gs.worksheet_cursor = Worksheet()
+    gs.cache_store = CacheStore()
+    gs.cache_check_interval = cache_check_interval
+    gs.snapshot_store = None
+    gs.write_batch = None
+    gs.drive = SimpleNamespace(version=1, requests=0)
+
+    def spreadsheet_version(spreadsheet_id=None):
+        gs.drive.requests += 1
+        return gs.drive.version
+    gs.spreadsheet_version = spreadsheet_version
+    return gs
+
+
+def test_writes_within_the_interval_send_no_version_request():
+    gs = open_sheets(cache_check_interval=3600)
+    gs.cached_data()
+    assert gs.drive.requests == 1
+    for i in range(10):
+        gs.update_cell(col=1, row=1, value='v{}'.format(i))
+    assert gs.drive.requests == 1
+    assert gs.worksheet_cursor.requests == ['get_values'] + ['update_cell'] * 10
+    assert gs.get_values() == [['v9', 'b']]
+
+
+def test_written_cache_is_stamped_at_the_next_check():
+    gs = open_sheets(cache_check_interval=3600)
+    cache = gs.cached_data()
+    gs.update_cell(col=1, row=1, value='x')
+    assert cache.version is None
+    gs.drive.version = 2
+    cache.checked_at -= 3600
+    assert gs.get_values() == [['x', 'b']]
+    assert gs.drive.requests == 2
+    assert cache.version == 2
+    assert gs.worksheet_cursor.requests == ['get_values', 'update_cell']
+
+
+def test_external_change_expires_the_cache_before_a_write():
+    gs = open_sheets(cache_check_interval=3600)
+    cache = gs.cached_data()
+    gs.drive.version = 2
+    cache.checked_at -= 3600
+    gs.update_cell(col=1, row=1, value='x')
+    assert cache.expired()
+    assert gs.get_values() == [['x', 'b']]
+    assert gs.worksheet_cursor.requests == ['get_values', 'update_cell', 'get_values']
+
+
+def test_no_version_request_without_interval():
+    gs = open_sheets(cache_check_interval=None)
+    gs.cached_data()
+    gs.update_cell(col=1, row=1, value='x')
+    assert gs.drive.requests == 0
+    assert gs.get_values() == [['x', 'b']]
@@ -0,0 +1,152 @@
+from types import SimpleNamespace
+from gspread_rpa.write_batch import WriteBatch, a1_range, range_rect, row_blocks, range_groups
+
+
+class Worksheet(object):
+    """ records the batch requests it is sent """
+
+    def __init__(self, id=0, spreadsheet_id='sid'):
+        self.id = id
+        self.spreadsheet = SimpleNamespace(id=spreadsheet_id)
+        self.requests = []
+
+    def batch_clear(self, ranges):
+        self.requests.append(('batchClear', ranges))
+
+    def values_batch_update(self, data, value_input_option='RAW'):
+        self.requests.append(('batchUpdate', value_input_option, data))
+        return {'totalUpdatedCells': sum(len(row) for _, values in data for row in values)}
+
+
+def test_a1_range_and_range_rect():
+    assert a1_range(1, 11, 3, 12) == 'A11:C12'
+    assert range_rect("'Sheet1'!A11:C12") == (1, 11, 3, 12)
+    assert range_rect('B2') == (2, 2, 2, 2)
+
+
+def test_last_write_of_a_cell_wins():
+    batch = WriteBatch()
+    ws = Worksheet()
+    batch.write(ws, [(1, 1, 'a'), (2, 1, 'b')], 'RAW')
+    batch.write(ws, [(1, 1, 'c'), (2, 1, None)], 'RAW')
+    assert batch.flush() == 2
+    assert ws.requests == [('batchUpdate', 'RAW', [('A1:B1', [['c', 'b']])])]
+
+
+def test_adjacent_cells_merged_into_rectangles():
+    batch = WriteBatch()
+    ws = Worksheet()
+    batch.write(ws, [(col, row, col * row) for row in (1, 2) for col in (1, 2)], 'RAW')
+    batch.write(ws, [(5, 9, 'x')], 'RAW')
+    batch.flush()
+    assert ws.requests == [('batchUpdate', 'RAW', [('A1:B2', [[1, 2], [2, 4]]), ('E9:E9', [['x']])])]
+
+
+def test_clear_drops_the_pending_writes_it_covers():
+    batch = WriteBatch()
+    ws = Worksheet()
+    batch.write(ws, [(1, 1, 'a'), (1, 5, 'b')], 'RAW')
+    batch.clear(ws, [(1, 1, 2, 2)])
+    batch.clear(ws, [(1, 1, 2, 2)])
+    batch.flush()
+    # clears are sent first
+    assert ws.requests == [('batchClear', ['A1:B2']), ('batchUpdate', 'RAW', [('A5:A5', [['b']])])]
+
+
+def test_one_request_per_worksheet_and_value_input_option():
+    batch = WriteBatch(max_cells=2)
+    ws1, ws2 = Worksheet(1), Worksheet(2)
+    batch.write(ws1, [(1, 1, 'a')], 'RAW')
+    batch.write(ws1, [(2, 1, '=A1')], 'USER_ENTERED')
+    assert not batch.full()
+    batch.write(ws2, [(1, 1, 'x')], 'RAW')
+    assert batch.full()
+    assert sorted(batch.keys()) == [('sid', 1), ('sid', 2)]
+    assert batch.flush() == 3
+    assert sorted(r[1] for r in ws1.requests) == ['RAW', 'USER_ENTERED']
+    assert len(ws2.requests) == 1
+    assert batch.size() == 0
+
+
+def test_queue_emptied_when_flush_fails():
+    class Failing(Worksheet):
+        def values_batch_update(self, data, value_input_option='RAW'):
+            raise IOError('down')
+
+    batch = WriteBatch()
+    batch.write(Failing(), [(1, 1, 'a')], 'RAW')
+    try:
+        batch.flush()
+    except IOError:
+        pass
+    assert batch.size() == 0
+
+
+def test_discard_spreadsheet():
+    batch = WriteBatch()
+    ws = Worksheet()
+    batch.write(ws, [(1, 1, 'a')], 'RAW')
+    batch.write(Worksheet(spreadsheet_id='other'), [(1, 1, 'b')], 'RAW')
+    batch.discard('sid')
+    assert batch.keys() == [('other', 0)]
+
+
+def open_sheets():
+    from gspread_rpa import GoogleSheets
+    from gspread_rpa.data_cache import CacheStore
+    gs = GoogleSheets.__new__(GoogleSheets)
+    gs.worksheet_cursor = Worksheet()
+    gs.spreadsheet_cursor = gs.worksheet_cursor.spreadsheet
+    gs.cache_store = CacheStore()
+    gs.cache_check_interval = None
+    gs.snapshot_store = None
+    gs.write_batch = None
+    return gs
+
+
+def test_batch_session_sends_once_on_exit():
+    gs = open_sheets()
+    with gs.batch():
+        for row in range(1, 4):
+            gs.update_cell(col=1, row=row, value='v{}'.format(row))
+        gs.update_cell(col=1, row=1, value='last')
+        assert gs.worksheet_cursor.requests == []
+    assert gs.worksheet_cursor.requests == [
+        ('batchUpdate', 'USER_ENTERED', [('A1:A3', [['last'], ['v2'], ['v3']])])]
+
+
+def test_batch_session_body_raising_sends_nothing():
+    gs = open_sheets()
+    gs.data_cache.store([['a']])
+    try:
+        with gs.batch():
+            gs.update_cell(col=1, row=1, value='b')
+            assert gs.data_cache.value(1, 1) == 'b'
+            raise KeyError('body')
+    except KeyError:
+        pass
+    assert gs.worksheet_cursor.requests == []
+    assert gs.write_batch is None
+    # the cache holding the unsent write is dropped
+    assert gs.data_cache.expired()
+
+
+def test_row_blocks_cell_budget():
+    values = [['x'] * 4 for _ in range(5)]
+    assert [(offset, len(rows)) for offset, rows in row_blocks(values, max_cells=8)] == [(0, 2), (2, 2), (4, 1)]
+    assert list(row_blocks(values)) == [(0, values)]
+    # a row over the budget is a block on its own
+    assert [len(rows) for _, rows in row_blocks([['x'] * 9, ['x']], max_cells=8)] == [1, 1]
+
+
+def test_row_blocks_byte_budget():
+    values = [['x'] * 4 for _ in range(10)]
+    row_size = len('["x", "x", "x", "x"]') + 1
+    assert [len(rows) for _, rows in row_blocks(values, max_bytes=3 * row_size)] == [3, 3, 3, 1]
+
+
+def test_range_groups():
+    data = [('A{}'.format(i), [['v', 'v']]) for i in range(1, 6)]
+    assert [len(group) for group in range_groups(data, max_cells=4)] == [2, 2, 1]
+    assert [len(group) for group in range_groups(data, max_bytes=len('[["v", "v"]]') * 3)] == [3, 2]
+    assert [len(group) for group in range_groups(data)] == [5]